@@ -0,0 +1,122 @@
+import numpy as np
+
+class Integral_Histogram:
+    # Number of patterns that are counted at once while building the integral histogram,
+    # which bounds the size of the temporary index array
+    BAND_SIZE = 1 << 20
+
+    def __init__(self, patterns, bins, step=1):
+        # The integral histogram holds for each position the histogram of all patterns
+        # above and to the left of it, so the histogram of any rectangle follows from the
+        # histograms at its four corners. To save memory the positions can be limited to
+        # multiples of the step (and the bottom and right edges), which only allows
+        # rectangles whose edges lie on those positions.
+        self.height, self.width = patterns.shape
+        self.bins = bins
+        self.step = step
+        rows = -(-self.height // step)
+        columns = -(-self.width // step)
+
+        # The counts never exceed the number of patterns, so use the smallest type for them
+        self.integral = np.zeros((rows + 1, columns + 1, bins), dtype=np.min_scalar_type(self.height * self.width))
+
+        # Count the patterns of each block of step by step patterns in bands of rows,
+        # using a single bincount over the combined block and pattern index
+        band = max(1, Integral_Histogram.BAND_SIZE // (self.width * step)) * step
+        offsets = (np.arange(self.width) // step) * bins
+        for top in xrange(0, self.height, band):
+            bottom = min(top + band, self.height)
+            indices = ((np.arange(top, bottom) // step - top // step) * columns * bins)[:, np.newaxis] + offsets
+            indices = indices + patterns[top:bottom]
+            blocks = -(-(bottom - top) // step)
+            counts = np.bincount(indices.ravel(), minlength=blocks * columns * bins).reshape(blocks, columns, bins)
+            self.integral[1 + top // step:1 + top // step + blocks, 1:] = counts
+
+        np.cumsum(self.integral, axis=0, dtype=self.integral.dtype, out=self.integral)
+        np.cumsum(self.integral, axis=1, dtype=self.integral.dtype, out=self.integral)
+
+    @staticmethod
+    def size(height, width, bins, step=1):
+        # Number of bytes of the integral histogram of patterns of the given dimensions
+        dtype = np.min_scalar_type(height * width)
+        return (-(-height // step) + 1) * (-(-width // step) + 1) * bins * dtype.itemsize
+
+    def _index(self, coordinates, edge):
+        # Convert pattern coordinates to positions in the integral histogram
+        coordinates = np.asarray(coordinates)
+        if np.any((coordinates % self.step != 0) & (coordinates != edge)) or np.any((coordinates < 0) | (coordinates > edge)):
+            raise ValueError("Region edges must be multiples of {} within the patterns".format(self.step))
+
+        return -(-coordinates // self.step)
+
+    def region(self, top, left, bottom, right):
+        # Histogram of the patterns in rows [top, bottom) and columns [left, right)
+        return self.regions([(top, left, bottom, right)])[0]
+
+    def regions(self, boxes):
+        # Histograms of any number of rectangles given as (top, left, bottom, right) at
+        # once. The differences are taken in an order in which they are never negative.
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        top = self._index(boxes[:, 0], self.height)
+        left = self._index(boxes[:, 1], self.width)
+        bottom = self._index(boxes[:, 2], self.height)
+        right = self._index(boxes[:, 3], self.width)
+        integral = self.integral
+        histograms = (integral[bottom, right] - integral[top, right]) - (integral[bottom, left] - integral[top, left])
+        return histograms.astype(np.int64)
+
+    @staticmethod
+    def cells(patterns, bins, rows, columns):
+        # Divide the patterns into a grid of cells of (nearly) equal size and concatenate
+        # the histograms of the cells in row-major order. Each cell is only needed once,
+        # so no integral histogram is built. Instead the patterns of each cell are counted
+        # directly in bands of rows, which keeps the memory usage at a single band.
+        height, width = patterns.shape
+        vertical = np.round(np.linspace(0, height, rows + 1)).astype(np.int64)
+        horizontal = np.round(np.linspace(0, width, columns + 1)).astype(np.int64)
+        histograms = np.zeros((rows, columns, bins), dtype=np.int64)
+        for column in xrange(columns):
+            left, right = horizontal[column], horizontal[column + 1]
+            band = max(1, Integral_Histogram.BAND_SIZE // max(1, right - left))
+            for row in xrange(rows):
+                for top in xrange(vertical[row], vertical[row + 1], band):
+                    bottom = min(top + band, vertical[row + 1])
+                    histograms[row, column] += np.bincount(patterns[top:bottom, left:right].ravel(), minlength=bins)
+
+        return histograms.ravel()
+
+    def windows(self, height, width, stride, first=0, last=None):
+        # Histograms of all windows of the given size whose top-left corners lie on
+        # multiples of the stride, in row-major order. Only the rows of windows starting
+        # in [first, last) are returned, so that large images can be done in batches.
+        tops = np.arange(first, min(self.height - height + 1, self.height if last is None else last), stride)
+        lefts = np.arange(0, self.width - width + 1, stride)
+        tops, lefts = [array.ravel() for array in np.meshgrid(tops, lefts, indexing="ij")]
+        boxes = np.column_stack([tops, lefts, tops + height, lefts + width])
+        return (boxes, self.regions(boxes))
+
+    @staticmethod
+    def sliding(patterns, bins, height, width, stride, memory):
+        # Generate the windows of the patterns in batches, while keeping the integral
+        # histogram within the given number of bytes. Only the positions on multiples of
+        # the greatest common divisor of the window size and the stride are needed, and
+        # the integral histogram is built for one strip of rows of windows at a time.
+        step = Integral_Histogram._divisor(Integral_Histogram._divisor(height, width), stride)
+        total_height, total_width = patterns.shape
+        count = 1
+        while (count * stride + height <= total_height and
+               Integral_Histogram.size(count * stride + height, total_width, bins, step) <= memory):
+            count += 1
+
+        for top in xrange(0, total_height - height + 1, count * stride):
+            bottom = min(top + (count - 1) * stride + height, total_height)
+            boxes, histograms = Integral_Histogram(patterns[top:bottom], bins, step).windows(height, width, stride, 0, count * stride)
+            boxes[:, [0, 2]] += top
+            yield (boxes, histograms)
+
+    @staticmethod
+    def _divisor(first, second):
+        while second:
+            first, second = second, first % second
+
+        return first
@@ -1,27 +1,260 @@
+import math
 import numpy as np
 from PIL import Image
+from Profiler import Profiler
 
 class LBP:
-    def __init__(self, input, num_processes, output):
-        # Convert the image to grayscale
-        self.image = Image.open(input).convert("L")
-        self.width = self.image.size[0]
-        self.height = self.image.size[1]
-        self.patterns = []
+    # Neighbor offsets (row, column), starting at the top-left pixel and moving clockwise
+    NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+    # Interpolated sample values are compared to the center pixel with a small tolerance
+    # to prevent floating point noise from setting bits in flat regions of the image
+    TOLERANCE = 1e-3
+
+    # Sampling tables for each combination of points and radius
+    SAMPLES = {}
+
+    # Lookup tables for each combination of mapping and points
+    MAPPINGS = {}
+
+    def __init__(self, input, num_processes, output, kernel="python", shared_memory=False, points=8, radius=1,
+                 mapping="none", histogram_only=False, strip_height=256, tile_size=None, schedule="dynamic",
+                 output_name=None, profile=False):
+        # The profiler records the time spent on each phase, the bytes sent between
+        # processes and the work of each process if profiling is enabled
+        self.profiler = Profiler(profile)
+        start = self.profiler.clock()
+        self._open(input)
+        self.profiler.measure("decode", start)
+        self.patterns = None
         self.num_processes = num_processes
         self.output = output
+        self.kernel = kernel
+        self.shared_memory = shared_memory
+        self.points = points
+        self.radius = radius
+        self.samples = LBP.sample(points, radius)
+        self.border = max([max(abs(row), abs(column)) for sample in self.samples for row, column, weight in sample])
+        self.mapping = mapping
+        self.histogram_only = histogram_only
+        self.histogram = None
+        self.strip_height = strip_height
+        self.tile_size = tile_size
+        self.schedule = schedule
+        self.output_name = output_name
+        self.table = LBP.map(mapping, points)
+        if self.table is None:
+            self.dtype = LBP.dtype(points)
+            self.bins = 2 ** points
+        else:
+            self.dtype = self.table.dtype.type
+            self.bins = int(self.table.max()) + 1
+
+    @staticmethod
+    def sample(points, radius):
+        # Precompute the offsets and bilinear weights of the sample points once
+        # for each combination of points and radius. Each sample point is a list
+        # of (row, column, weight) tuples of the pixels that contribute to it.
+        key = (points, radius)
+        if key in LBP.SAMPLES:
+            return LBP.SAMPLES[key]
+
+        if key == (8, 1):
+            # The regular operator uses the square neighborhood of the pixel
+            samples = [[(row, column, 1.0)] for row, column in LBP.NEIGHBORS]
+        else:
+            # Place the sample points on a circle, starting at the top-left and
+            # moving clockwise, and interpolate the points between pixels
+            samples = []
+            for point in xrange(points):
+                angle = (3 * math.pi / 4) - (2 * math.pi * point / points)
+                row = round(-radius * math.sin(angle), 6)
+                column = round(radius * math.cos(angle), 6)
+                top = int(math.floor(row))
+                left = int(math.floor(column))
+                vertical = row - top
+                horizontal = column - left
+                corners = [
+                    (top, left, (1 - vertical) * (1 - horizontal)),
+                    (top, left + 1, (1 - vertical) * horizontal),
+                    (top + 1, left, vertical * (1 - horizontal)),
+                    (top + 1, left + 1, vertical * horizontal)
+                ]
+                samples.append([corner for corner in corners if corner[2] > 1e-9])
+
+        LBP.SAMPLES[key] = samples
+        return samples
+
+    @staticmethod
+    def dtype(points):
+        # Use the smallest integer type that fits a bit for each sample point
+        for dtype in [np.uint8, np.uint16, np.uint32]:
+            if points <= np.iinfo(dtype).bits:
+                return dtype
+
+        raise ValueError("At most 32 points are supported")
+
+    @staticmethod
+    def map(mapping, points):
+        # Build the lookup table that maps each pattern to its label once for
+        # each combination of mapping and points. The labels are numbered in
+        # the order of the patterns, so they can be used as histogram bins.
+        key = (mapping, points)
+        if mapping == "none":
+            return None
+        if key in LBP.MAPPINGS:
+            return LBP.MAPPINGS[key]
+
+        patterns = np.arange(2 ** points, dtype=np.uint32)
+
+        # Count the ones and the circular 0/1 transitions in each pattern
+        rotated = LBP._rotate(patterns, points)
+        changes = patterns ^ rotated
+        ones = np.zeros(patterns.shape, dtype=np.uint8)
+        transitions = np.zeros(patterns.shape, dtype=np.uint8)
+        for bit in xrange(points):
+            ones += ((patterns >> bit) & 1).astype(np.uint8)
+            transitions += ((changes >> bit) & 1).astype(np.uint8)
+
+        uniform = transitions <= 2
+        if mapping == "uniform":
+            # Each uniform pattern gets its own label and all other patterns share one label
+            table = np.empty(patterns.shape, dtype=np.int64)
+            table[uniform] = np.arange(np.count_nonzero(uniform))
+            table[~uniform] = np.count_nonzero(uniform)
+        elif mapping == "ri":
+            # All rotations of a pattern get the label of the smallest rotation
+            minimum = patterns.copy()
+            for rotation in xrange(1, points):
+                np.minimum(minimum, rotated, out=minimum)
+                rotated = LBP._rotate(rotated, points)
+
+            table = np.unique(minimum, return_inverse=True)[1]
+        elif mapping == "riu2":
+            # Uniform patterns are labeled by their number of ones and all other patterns share one label
+            table = np.where(uniform, ones, points + 1)
+        else:
+            raise ValueError("Unknown mapping '{}'".format(mapping))
+
+        table = table.astype(np.min_scalar_type(table.max()))
+        LBP.MAPPINGS[key] = table
+        return table
+
+    @staticmethod
+    def _rotate(patterns, points):
+        # Rotate the bits of each pattern by one position
+        return (patterns >> 1) | ((patterns & 1) << (points - 1))
 
     def execute(self):
         self._process()
         if self.output:
             self._output()
 
-    def _process(self):
+    def _histogram(self, patterns):
+        # Count the occurrences of each label in the given patterns
+        return np.bincount(np.asarray(patterns).ravel(), minlength=self.bins).astype(np.int64)
+
+    def _accumulate(self, pixels, left_bound, right_bound):
+        # Calculate the histogram of the patterns of the rows in [left_bound, right_bound)
+        # in blocks of at most the strip height, using a single buffer for the patterns of
+        # all blocks, so that the patterns of all rows are never in memory at once
+        histogram = np.zeros(self.bins, dtype=np.int64)
+        buffer = np.empty((min(self.strip_height, max(1, right_bound - left_bound)), self.width - 2 * self.border), dtype=self.dtype)
+        for top in xrange(left_bound, right_bound, self.strip_height):
+            bottom = min(top + self.strip_height, right_bound)
+            histogram += self._histogram(self._calculate(pixels, top, bottom, buffer[:bottom - top]))
+
+        return histogram
+
+    def _open(self, input):
+        # Convert the image to grayscale. Besides a file name, the input may
+        # also be an already decoded image or an array of grayscale or color pixels.
+        if isinstance(input, np.ndarray):
+            self.image = Image.fromarray(input).convert("L")
+        elif isinstance(input, Image.Image):
+            self.image = input.convert("L")
+        else:
+            self.image = LBP.decode(input)
+
+        self.width = self.image.size[0]
+        self.height = self.image.size[1]
+
+    def _bounds(self, process_id):
+        # Set the left and right bounds of the segment to process
+        segment_height = int(np.floor(self.height / self.num_processes))
+        left_bound = max(process_id * segment_height, self.border)
+        right_bound = min((process_id * segment_height) + segment_height, self.height - self.border)
+        if process_id == (self.num_processes - 1):
+            # The last process should also process any remaining rows
+            right_bound = self.height - self.border
+
+        return (left_bound, max(left_bound, right_bound))
+
+    def _pixels(self):
+        # The NumPy kernel works on the image as a whole array, while the
+        # Python kernel is fastest with plain lists of rows.
+        if self.kernel == "numpy":
+            return np.array(self.image)
+
         pixels = list(self.image.getdata())
-        pixels = [pixels[i * self.width:(i + 1) * self.width] for i in xrange(self.height)]
+        return [pixels[i * self.width:(i + 1) * self.width] for i in xrange(self.height)]
+
+    def _tiles(self, tile_height, tile_width):
+        # Divide the result into tiles in row-major order. Each tile is given by the
+        # rows and columns in the result that it covers. Its pixels are the same rows
+        # and columns of the image, extended with the border on the bottom and right.
+        height = self.height - 2 * self.border
+        width = self.width - 2 * self.border
+        return [
+            (top, min(top + tile_height, height), left, min(left + tile_width, width))
+            for top in xrange(0, height, tile_height)
+            for left in xrange(0, width, tile_width)
+        ]
+
+    def _process(self):
+        # Calculate LBP for each non-edge pixel directly into the result array
+        start = self.profiler.clock()
+        self._prepare()
+        if self.histogram_only:
+            self.histogram = self._accumulate(self._pixels(), self.border, self.height - self.border)
+        else:
+            self._calculate(self._pixels(), self.border, self.height - self.border, self.patterns)
+
+        self.profiler.record(self.profiler.worker(0, start))
+        self.profiler.measure("compute", start)
 
-        # Calculate LBP for each non-edge pixel
-        for i in xrange(1, self.height - 1):
+    def _prepare(self):
+        # Preallocate the result array for the patterns of all non-edge pixels,
+        # or the histogram of the patterns in histogram only mode
+        if self.histogram_only:
+            self.histogram = np.zeros(self.bins, dtype=np.int64)
+        else:
+            self.patterns = np.empty((self.height - 2 * self.border, self.width - 2 * self.border), dtype=self.dtype)
+
+    def _calculate(self, pixels, left_bound, right_bound, patterns=None):
+        # Calculate the patterns for the rows in [left_bound, right_bound) of the given
+        # pixels into the given result rows, or into a new array if they are omitted.
+        # The rows within the border above and below must be present as well.
+        if patterns is None:
+            patterns = np.empty((right_bound - left_bound, self.width - 2 * self.border), dtype=self.dtype)
+
+        if self.kernel == "numpy":
+            raw_patterns = self._calculate_numpy(pixels, left_bound, right_bound, patterns if self.table is None else None)
+        else:
+            raw_patterns = self._calculate_python(pixels, left_bound, right_bound)
+            raw_patterns = np.array(raw_patterns, dtype=LBP.dtype(self.points)).reshape(patterns.shape)
+
+        if self.table is not None:
+            np.take(self.table, raw_patterns, out=patterns, mode="clip")
+        elif raw_patterns is not patterns:
+            patterns[:] = raw_patterns
+
+        return patterns
+
+    def _calculate_python(self, pixels, left_bound, right_bound):
+        # Only the regular operator with 8 points and radius 1 is supported
+        patterns = []
+        for i in xrange(left_bound, right_bound):
             # Cache only the rows we need (within the neighborhood)
             previous_row = pixels[i - 1]
             current_row = pixels[i]
@@ -40,10 +273,97 @@ class LBP:
                 pattern = pattern | (1 << 5) if pixel < next_row[j] else pattern
                 pattern = pattern | (1 << 6) if pixel < next_row[j-1] else pattern
                 pattern = pattern | (1 << 7) if pixel < current_row[j-1] else pattern
-                self.patterns.append(pattern)
+                patterns.append(pattern)
+
+        return patterns
+
+    def _calculate_numpy(self, pixels, left_bound, right_bound, patterns=None):
+        # Compare the center pixels to each shifted (and possibly interpolated)
+        # neighbor array at once and OR the resulting bits into the feature vectors.
+        # The buffers are reused for all sample points to keep temporaries to a minimum.
+        width = pixels.shape[1]
+        border = self.border
+        center = pixels[left_bound:right_bound, border:width - border]
+        dtype = LBP.dtype(self.points)
+        if patterns is None:
+            patterns = np.zeros(center.shape, dtype=dtype)
+        else:
+            patterns.fill(0)
+
+        comparison = np.empty(center.shape, dtype=np.bool_)
+        if dtype == np.uint8:
+            bits = comparison.view(np.uint8)
+        else:
+            bits = np.empty(center.shape, dtype=dtype)
+
+        center_values = None
+        for bit, sample in enumerate(self.samples):
+            neighbors = [
+                (pixels[left_bound + row:right_bound + row, border + column:width - border + column], weight)
+                for row, column, weight in sample
+            ]
+            if len(neighbors) == 1:
+                # The sample point lies exactly on a pixel
+                np.less(center, neighbors[0][0], out=comparison)
+            else:
+                if center_values is None:
+                    center_values = center + np.float32(LBP.TOLERANCE)
+                    interpolated = np.empty(center.shape, dtype=np.float32)
+                    term = np.empty(center.shape, dtype=np.float32)
+
+                # Bilinearly interpolate the sample point from the surrounding pixels
+                np.multiply(neighbors[0][0], np.float32(neighbors[0][1]), out=interpolated)
+                for neighbor, weight in neighbors[1:]:
+                    np.multiply(neighbor, np.float32(weight), out=term)
+                    np.add(interpolated, term, out=interpolated)
+
+                np.less(center_values, interpolated, out=comparison)
+
+            if bits.base is not comparison:
+                np.copyto(bits, comparison)
+
+            np.left_shift(bits, bit, out=bits)
+            np.bitwise_or(patterns, bits, out=patterns)
+
+        return patterns
+
+    def _store(self, process_id, segment):
+        # Write the patterns of a segment into its rows of the result array. In
+        # histogram only mode the segment is a histogram that is added instead.
+        if self.histogram_only:
+            self.histogram += segment
+            return
+
+        left_bound, right_bound = self._bounds(process_id)
+        self.patterns[left_bound - self.border:right_bound - self.border] = segment
 
     def _output(self):
-        # Write the result to an image file
-        result_image = Image.new(self.image.mode, (self.width - 2, self.height - 2))
-        result_image.putdata(self.patterns)
-        result_image.save("output.png")
+        # Write the result to a file named after the output name (if any)
+        start = self.profiler.clock()
+        if self.histogram_only:
+            LBP.save(self.histogram, self.output_name)
+        else:
+            LBP.save(self.patterns, self.output_name)
+
+        self.profiler.measure("encode", start)
+
+    @staticmethod
+    def decode(input):
+        # Open an image file as a grayscale image. The decoder of a JPEG file produces the
+        # grayscale image directly from the luma of the file, so the color image is never
+        # in memory. An image that is already grayscale is not copied.
+        image = Image.open(input)
+        image.draft("L", image.size)
+        return image if image.mode == "L" else image.convert("L")
+
+    @staticmethod
+    def save(result, output_name=None):
+        # Write a histogram to a text file and patterns to an image file. Patterns of
+        # more than 16 bits do not fit in a PNG file, so those are written to a 32-bit
+        # TIFF file instead. The image shares the memory of the patterns array.
+        if result.ndim == 1:
+            np.savetxt("{}.txt".format(output_name or "histogram"), result, fmt="%d")
+        elif result.dtype == np.uint32:
+            Image.fromarray(result.view(np.int32)).save("{}.tiff".format(output_name or "output"))
+        else:
+            Image.fromarray(result).save("{}.png".format(output_name or "output"))
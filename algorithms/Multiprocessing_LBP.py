@@ -1,55 +1,41 @@
 import numpy as np
 from PIL import Image
 from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray
 from LBP import LBP
 
 class Multiprocessing_LBP(LBP):
-    def __init__(self, input, num_processes, output):
-        LBP.__init__(self, input, num_processes, output)
+    def __init__(self, input, num_processes, output, **options):
+        LBP.__init__(self, input, num_processes, output, **options)
 
     def execute(self):
-        self._distribute()
+        if self.shared_memory:
+            self._distribute_shared()
+        else:
+            self._distribute()
+
         if self.output:
             self._output()
 
     def _process(self, process_id, pixels, queue):
-        # Set the left and right bounds of the segment to process
-        segment_height = int(np.floor(self.height / self.num_processes))
-        left_bound = (process_id * segment_height) if process_id != 0 else 1
-        right_bound = (process_id * segment_height) + segment_height
-        if process_id == (self.num_processes - 1):
-            # The last process should also process any remaining rows
-            right_bound = self.height - 1
+        start = self.profiler.clock()
+        left_bound, right_bound = self._bounds(process_id)
+
+        # Calculate LBP for each non-edge pixel in the segment. In histogram
+        # only mode just the histogram of the segment is sent back.
+        if self.histogram_only:
+            patterns = self._accumulate(pixels, left_bound, right_bound)
+        else:
+            patterns = self._calculate(pixels, left_bound, right_bound)
 
-        # Calculate LBP for each non-edge pixel in the segment
-        patterns = []
-        for i in xrange(left_bound, right_bound):
-            # Cache only the rows we need (within the neighborhood)
-            previous_row = pixels[i - 1]
-            current_row = pixels[i]
-            next_row = pixels[i + 1]
-
-            for j in xrange(1, self.width - 1):
-                # Compare this pixel to its neighbors, starting at the top-left pixel and moving
-                # clockwise, and use bit operations to efficiently update the feature vector
-                pixel = current_row[j]
-                pattern = 0
-                pattern = pattern | (1 << 0) if pixel < previous_row[j-1] else pattern
-                pattern = pattern | (1 << 1) if pixel < previous_row[j] else pattern
-                pattern = pattern | (1 << 2) if pixel < previous_row[j+1] else pattern
-                pattern = pattern | (1 << 3) if pixel < current_row[j+1] else pattern
-                pattern = pattern | (1 << 4) if pixel < next_row[j+1] else pattern
-                pattern = pattern | (1 << 5) if pixel < next_row[j] else pattern
-                pattern = pattern | (1 << 6) if pixel < next_row[j-1] else pattern
-                pattern = pattern | (1 << 7) if pixel < current_row[j-1] else pattern
-                patterns.append(pattern)
-                
         queue.put({
             'process_id': process_id,
-            'patterns': patterns
+            'patterns': patterns,
+            'worker': self.profiler.worker(process_id, start)
         })
 
     def _distribute(self):
+        start = self.profiler.clock()
         pixels = np.array(self.image)
 
         # Spawn the processes
@@ -58,14 +44,105 @@ class Multiprocessing_LBP(LBP):
         for process_id in xrange(self.num_processes):
             process = Process(target=self._process, args=(process_id, pixels, queue))
             process.start()
+            self.profiler.transfer("distribute", pixels.nbytes)
+            processes.append(process)
+
+        self._gather(processes, queue, start)
+
+    def _gather(self, processes, queue, start):
+        # Write the patterns of each process into the result array as soon
+        # as they arrive and wait for all processes to finish
+        start = self.profiler.measure("distribute", start)
+        self._prepare()
+        for process in processes:
+            result = queue.get()
+            start = self.profiler.measure("compute", start)
+            self.profiler.transfer("gather", result['patterns'].nbytes)
+            self._store(result['process_id'], result['patterns'])
+            self.profiler.record(result['worker'])
+            start = self.profiler.measure("gather", start)
+
+        [process.join() for process in processes]
+        self.profiler.measure("gather", start)
+
+    def _process_shared(self, process_id, shared_pixels, shared_patterns, shared_statistics):
+        # Attach to the shared image buffer without copying it
+        pixels = np.frombuffer(shared_pixels, dtype=np.uint8).reshape(self.height, self.width)
+        left_bound, right_bound = self._bounds(process_id)
+
+        # Calculate LBP for each non-edge pixel in the segment
+        self._calculate_shared(process_id, shared_patterns, shared_statistics, pixels, left_bound, right_bound)
+
+    def _calculate_shared(self, process_id, shared_patterns, shared_statistics, pixels, left_bound, right_bound):
+        # Calculate the patterns directly into the segment's rows of the shared result
+        # buffer. In histogram only mode each process has its own histogram row instead.
+        # When profiling, the work of the process is written to its statistics row.
+        start = self.profiler.clock()
+        if self.histogram_only:
+            histograms = np.frombuffer(shared_patterns, dtype=np.int64).reshape(self.num_processes, self.bins)
+            histograms[process_id] = self._accumulate(pixels, left_bound, right_bound)
+        else:
+            segment_left_bound, segment_right_bound = self._bounds(process_id)
+            patterns = np.frombuffer(shared_patterns, dtype=self.dtype)
+            patterns = patterns.reshape(self.height - 2 * self.border, self.width - 2 * self.border)
+            patterns = patterns[segment_left_bound - self.border:segment_right_bound - self.border]
+            self._calculate(pixels, left_bound, right_bound, patterns)
+
+        worker = self.profiler.worker(process_id, start)
+        if worker is not None:
+            statistics = np.frombuffer(shared_statistics, dtype=np.float64).reshape(self.num_processes, 2)
+            statistics[process_id] = (worker['time'], worker['memory'])
+
+    def _distribute_shared(self):
+        # Place the image and a preallocated result buffer in shared memory, so
+        # that only the process identifiers are passed to the processes and
+        # nothing has to be sent back other than the exit status.
+        start = self.profiler.clock()
+        shared_pixels, shared_patterns, shared_statistics = self._share()
+
+        # Spawn the processes
+        processes = []
+        for process_id in xrange(self.num_processes):
+            arguments = (process_id, shared_pixels, shared_patterns, shared_statistics)
+            process = Process(target=self._process_shared, args=arguments)
+            process.start()
             processes.append(process)
 
         # Wait for all processes to finish
-        results = [queue.get() for process in processes]
+        start = self.profiler.measure("distribute", start)
         [process.join() for process in processes]
+        start = self.profiler.measure("compute", start)
+        self._collect(shared_patterns, shared_statistics)
+        self.profiler.measure("gather", start)
+
+    def _share(self):
+        # Copy the image to shared memory and allocate the shared result buffer, which
+        # holds a histogram row for each process in histogram only mode, and a row
+        # for the time and memory usage of each process
+        shared_pixels = RawArray('B', self.height * self.width)
+        np.frombuffer(shared_pixels, dtype=np.uint8)[:] = np.asarray(self.image).ravel()
+        self.profiler.transfer("distribute", self.height * self.width)
+        if self.histogram_only:
+            size = self.num_processes * self.bins * np.dtype(np.int64).itemsize
+        else:
+            size = (self.height - 2 * self.border) * (self.width - 2 * self.border) * np.dtype(self.dtype).itemsize
+
+        return (shared_pixels, RawArray('B', size), RawArray('d', self.num_processes * 2))
+
+    def _collect(self, shared_patterns, shared_statistics):
+        # Merge the histograms of all processes or attach to the shared patterns
+        if self.profiler.enabled:
+            statistics = np.frombuffer(shared_statistics, dtype=np.float64).reshape(self.num_processes, 2)
+            for process_id in xrange(self.num_processes):
+                self.profiler.record({
+                    'process_id': process_id,
+                    'time': float(statistics[process_id][0]),
+                    'memory': float(statistics[process_id][1])
+                })
 
-        # Format the pixels correctly for the output function,
-        # which expects a linear list of pixel values.
-        results = sorted(results, key=lambda k: k['process_id']) 
-        for result in results:
-            self.patterns.extend(result['patterns'])
+        if self.histogram_only:
+            histograms = np.frombuffer(shared_patterns, dtype=np.int64).reshape(self.num_processes, self.bins)
+            self.histogram = histograms.sum(axis=0)
+        else:
+            self.patterns = np.frombuffer(shared_patterns, dtype=self.dtype)
+            self.patterns = self.patterns.reshape(self.height - 2 * self.border, self.width - 2 * self.border)
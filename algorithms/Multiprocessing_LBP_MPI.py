@@ -1,76 +1,88 @@
-import time
 import numpy as np
 from PIL import Image
 from LBP import LBP
 from mpi4py import MPI
 
 class Multiprocessing_LBP_MPI(LBP):
-    def __init__(self, input, num_processes, output):
-        LBP.__init__(self, input, num_processes, output)
+    def __init__(self, input, num_processes, output, **options):
         self.communicator = MPI.COMM_WORLD
         self.process_id = self.communicator.rank
+        LBP.__init__(self, input, num_processes, output, **options)
         self.num_processes = self.communicator.size
 
     def execute(self):
+        self._run()
+        if self.process_id == 0 and self.output:
+            self._output()
+
+    def _open(self, input):
+        # Only the root process decodes the image. The other processes
+        # only need to know its dimensions to determine their bounds.
         if self.process_id == 0:
-            self._run_master()
-            if self.output:
-                self._output()
+            LBP._open(self, input)
+            size = (self.width, self.height)
         else:
-            pixels = np.array(self.image)
-            self._run_slave(pixels)
+            self.image = None
+            size = None
 
-    def _run_master(self):
-        num_processes = self.num_processes - 1
-        results = [0] * num_processes
-        status = MPI.Status()
+        self.width, self.height = self.communicator.bcast(size, root=0)
 
-        # Collect results of the slave processes
-        while 0 in results:
-            if self.communicator.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
-                process_id = status.Get_source()
-                results[process_id - 1] = self.communicator.recv(source=process_id, tag=MPI.ANY_TAG)
+    def _run(self):
+        start = self.profiler.clock()
+        bounds = [self._bounds(process_id) for process_id in xrange(self.num_processes)]
+        left_bound, right_bound = bounds[self.process_id]
 
-        # Format the pixels correctly for the output function,
-        # which expects a linear list of pixel values.
-        for result in results:
-            self.patterns.extend(result)
+        # Scatter the segments to all processes, including the root process itself.
+        # Because of the neighborhood, each segment includes the neighboring rows
+        # on either side, so the segments partially overlap in the image.
+        border = self.border
+        pixels = np.array(self.image) if self.process_id == 0 else None
+        counts = [(right - left + 2 * border) * self.width for left, right in bounds]
+        displacements = [(left - border) * self.width for left, right in bounds]
+        segment_pixels = np.empty((right_bound - left_bound + 2 * border, self.width), dtype=np.uint8)
+        self.communicator.Scatterv([pixels, counts, displacements, MPI.BYTE], [segment_pixels, MPI.BYTE], root=0)
+        self.profiler.transfer("distribute", sum(counts))
 
-    def _run_slave(self, pixels):
-        # Exclude the master process from the LBP work
-        num_processes = self.num_processes - 1
-        process_id = self.process_id - 1
+        # Calculate LBP for each non-edge pixel in the segment
+        start = self.profiler.measure("distribute", start)
+        if self.histogram_only:
+            segment_histogram = self._accumulate(segment_pixels, border, segment_pixels.shape[0] - border)
+            worker = self.profiler.worker(self.process_id, start)
+            start = self.profiler.measure("compute", start)
+            self._reduce(segment_histogram)
+            self._gather(worker, start)
+            return
 
-        # Set the left and right bounds of the segment to process
-        segment_height = int(np.floor(self.height / num_processes))
-        left_bound = (process_id * segment_height) if process_id != 0 else 1
-        right_bound = (process_id * segment_height) + segment_height
-        if process_id == num_processes - 1:
-            # The last process should also process any remaining rows
-            right_bound = self.height - 1
+        segment_patterns = self._calculate(segment_pixels, border, segment_pixels.shape[0] - border)
+        worker = self.profiler.worker(self.process_id, start)
+        start = self.profiler.measure("compute", start)
 
-        # Calculate LBP for each non-edge pixel in the segment
-        patterns = []
-        for i in xrange(left_bound, right_bound):
-            # Cache only the rows we need (within the neighborhood)
-            previous_row = pixels[i - 1]
-            current_row = pixels[i]
-            next_row = pixels[i + 1]
+        # Gather the patterns of all processes directly into the result buffer
+        # of the root process in the order of their segments
+        if self.process_id == 0:
+            self._prepare()
+
+        width = self.width - 2 * border
+        itemsize = np.dtype(self.dtype).itemsize
+        counts = [(right - left) * width * itemsize for left, right in bounds]
+        displacements = [(left - border) * width * itemsize for left, right in bounds]
+        self.communicator.Gatherv([segment_patterns, MPI.BYTE], [self.patterns, counts, displacements, MPI.BYTE], root=0)
+        self.profiler.transfer("gather", sum(counts))
+        self._gather(worker, start)
 
-            for j in xrange(1, self.width - 1):
-                # Compare this pixel to its neighbors, starting at the top-left pixel and moving
-                # clockwise, and use bit operations to efficiently update the feature vector
-                pixel = current_row[j]
-                pattern = 0
-                pattern = pattern | (1 << 0) if pixel < previous_row[j-1] else pattern
-                pattern = pattern | (1 << 1) if pixel < previous_row[j] else pattern
-                pattern = pattern | (1 << 2) if pixel < previous_row[j+1] else pattern
-                pattern = pattern | (1 << 3) if pixel < current_row[j+1] else pattern
-                pattern = pattern | (1 << 4) if pixel < next_row[j+1] else pattern
-                pattern = pattern | (1 << 5) if pixel < next_row[j] else pattern
-                pattern = pattern | (1 << 6) if pixel < next_row[j-1] else pattern
-                pattern = pattern | (1 << 7) if pixel < current_row[j-1] else pattern
-                patterns.append(pattern)
-                
-        # Send the results to the master process and stop this slave process
-        self.communicator.send(patterns, dest=0, tag=0)
+    def _gather(self, worker, start):
+        # Collect the descriptions of the work of all processes in the root process
+        if self.profiler.enabled:
+            for process_worker in self.communicator.gather(worker, root=0) or []:
+                self.profiler.record(process_worker)
+
+        self.profiler.measure("gather", start)
+
+    def _reduce(self, segment_histogram):
+        # Sum the histograms of all processes into the histogram of the root process
+        histogram = np.empty(self.bins, dtype=np.int64) if self.process_id == 0 else None
+        self.communicator.Reduce([segment_histogram, MPI.INT64_T], [histogram, MPI.INT64_T], op=MPI.SUM, root=0)
+        self.profiler.transfer("gather", self.num_processes * segment_histogram.nbytes)
+
+        if self.process_id == 0:
+            self.histogram = histogram
@@ -4,49 +4,43 @@ from multiprocessing import Process, Queue
 from Multiprocessing_LBP import Multiprocessing_LBP
 
 class Multiprocessing_Split_LBP(Multiprocessing_LBP):
-    def __init__(self, input, num_processes, output):
-        Multiprocessing_LBP.__init__(self, input, num_processes, output)
+    def __init__(self, input, num_processes, output, **options):
+        Multiprocessing_LBP.__init__(self, input, num_processes, output, **options)
 
     def _process(self, process_id, pixels, queue):
-        # Determine the bounds for processing
-        left_bound = 0
-        if process_id == 0:
-            left_bound = 1
-        right_bound = pixels.shape[0] - 1
-        if process_id == (self.num_processes - 1):
-            right_bound -= 1
-        
-        # Calculate LBP for each non-edge pixel in the segment
-        patterns = []
-        for i in xrange(left_bound, right_bound):
-            # Cache only the rows we need (within the neighborhood)
-            previous_row = pixels[i - 1]
-            current_row = pixels[i]
-            next_row = pixels[i + 1]
+        start = self.profiler.clock()
+
+        # Every row of the segment except for the rows within the border,
+        # which only serve as the neighborhood, must be processed
+        left_bound = self.border
+        right_bound = pixels.shape[0] - self.border
 
-            for j in xrange(1, self.width - 1):
-                # Compare this pixel to its neighbors, starting at the top-left pixel and moving
-                # clockwise, and use bit operations to efficiently update the feature vector
-                pixel = current_row[j]
-                pattern = 0
-                pattern = pattern | (1 << 0) if pixel < previous_row[j-1] else pattern
-                pattern = pattern | (1 << 1) if pixel < previous_row[j] else pattern
-                pattern = pattern | (1 << 2) if pixel < previous_row[j+1] else pattern
-                pattern = pattern | (1 << 3) if pixel < current_row[j+1] else pattern
-                pattern = pattern | (1 << 4) if pixel < next_row[j+1] else pattern
-                pattern = pattern | (1 << 5) if pixel < next_row[j] else pattern
-                pattern = pattern | (1 << 6) if pixel < next_row[j-1] else pattern
-                pattern = pattern | (1 << 7) if pixel < current_row[j-1] else pattern
-                patterns.append(pattern)
+        # Calculate LBP for each non-edge pixel in the segment. In histogram
+        # only mode just the histogram of the segment is sent back.
+        if self.histogram_only:
+            patterns = self._accumulate(pixels, left_bound, right_bound)
+        else:
+            patterns = self._calculate(pixels, left_bound, right_bound)
 
         queue.put({
             'process_id': process_id,
-            'patterns': patterns
+            'patterns': patterns,
+            'worker': self.profiler.worker(process_id, start)
         })
 
+    def _process_shared(self, process_id, shared_pixels, shared_patterns, shared_statistics):
+        # Attach only to the segment of the shared image buffer that this
+        # process works with, including the neighboring rows on either side
+        left_bound, right_bound = self._bounds(process_id)
+        pixels = np.frombuffer(shared_pixels, dtype=np.uint8).reshape(self.height, self.width)
+        pixels = pixels[left_bound - self.border:right_bound + self.border]
+
+        # Calculate LBP for each non-edge pixel in the segment
+        self._calculate_shared(process_id, shared_patterns, shared_statistics, pixels, self.border, pixels.shape[0] - self.border)
+
     def _distribute(self):
+        start = self.profiler.clock()
         pixels = np.array(self.image)
-        segment_height = int(np.floor(self.height / self.num_processes))
         processes = []
         queue = Queue()
         for process_id in xrange(self.num_processes):
@@ -54,26 +48,14 @@ class Multiprocessing_Split_LBP(Multiprocessing_LBP):
             # This is done in order to make the processes work independently.
             # Because of the neighborhood, each segment should partially overlap
             # with the next and/or previous segment.
-            left_bound = process_id * segment_height
-            right_bound = left_bound + segment_height
-            if process_id > 0:
-                left_bound -= 1
-            if process_id == (self.num_processes - 1):
-                # The last process should also process any remaining rows
-                right_bound = self.height
+            left_bound, right_bound = self._bounds(process_id)
 
-            # Start the process and pass only the pixels within the bounds
-            segment_pixels = pixels[left_bound:right_bound]
+            # Start the process and pass only the pixels within the bounds,
+            # including the neighboring rows on either side of the segment
+            segment_pixels = pixels[left_bound - self.border:right_bound + self.border]
             process = Process(target=self._process, args=(process_id, segment_pixels, queue))
             process.start()
+            self.profiler.transfer("distribute", segment_pixels.nbytes)
             processes.append(process)
-        
-        # Wait for all processes to finish
-        results = [queue.get() for process in processes]
-        [process.join() for process in processes]
 
-        # Format the pixels correctly for the output function,
-        # which expects a linear list of pixel values.
-        results = sorted(results, key=lambda k: k['process_id']) 
-        for result in results:
-            self.patterns.extend(result['patterns'])
+        self._gather(processes, queue, start)
@@ -0,0 +1,145 @@
+import math
+import numpy as np
+from multiprocessing import Process, Queue
+from Multiprocessing_LBP import Multiprocessing_LBP
+
+class Multiprocessing_Tiled_LBP(Multiprocessing_LBP):
+    # Tiles are at least this number of rows and columns, unless the image is smaller
+    MINIMUM_TILE_SIZE = 16
+
+    # The image is divided into at least this number of tiles for each process, so
+    # that processes that finish early can take over the remaining work
+    TILES_PER_PROCESS = 4
+
+    # Estimate of the bytes needed for each pixel of a tile by the NumPy kernel: the
+    # pixel, the pattern and the comparison and interpolation buffers
+    BYTES_PER_PIXEL = 16
+
+    def __init__(self, input, num_processes, output, **options):
+        Multiprocessing_LBP.__init__(self, input, num_processes, output, **options)
+
+    def execute(self):
+        self._distribute_tiles()
+        if self.output:
+            self._output()
+
+    @staticmethod
+    def cache_size():
+        # Size of the L2 cache of the first processor in bytes, or 256 kB if unknown
+        try:
+            with open("/sys/devices/system/cpu/cpu0/cache/index2/size") as file:
+                size = file.read().strip()
+        except IOError:
+            return 256 * 1024
+
+        units = {"K": 1024, "M": 1024 * 1024}
+        if size[-1] in units:
+            return int(size[:-1]) * units[size[-1]]
+
+        return int(size)
+
+    def _tile_size(self):
+        # Use the given tile size, or choose tiles of which the working set fits in the
+        # L2 cache, while dividing the image into enough tiles for all processes. Tiles
+        # are as wide as possible to keep the rows long. The Python kernel only works
+        # on entire rows, so its tiles always span the full width.
+        height = self.height - 2 * self.border
+        width = self.width - 2 * self.border
+        if self.tile_size is not None:
+            tile_height, tile_width = self.tile_size
+        else:
+            area = min(
+                Multiprocessing_Tiled_LBP.cache_size() // Multiprocessing_Tiled_LBP.BYTES_PER_PIXEL,
+                height * width // (self.num_processes * Multiprocessing_Tiled_LBP.TILES_PER_PROCESS)
+            )
+            area = max(area, Multiprocessing_Tiled_LBP.MINIMUM_TILE_SIZE ** 2)
+            tile_width = max(int(math.sqrt(area)), Multiprocessing_Tiled_LBP.MINIMUM_TILE_SIZE)
+            tile_height = area // min(tile_width, width)
+
+        if self.kernel != "numpy":
+            tile_width = width
+
+        return (max(1, min(tile_height, height)), max(1, min(tile_width, width)))
+
+    def _chunks(self, count):
+        # Group the tiles into the chunks that the processes take from the queue. With
+        # dynamic scheduling each chunk is a single tile. With guided scheduling the
+        # chunks start large to limit the number of queue operations and shrink as
+        # fewer tiles remain, so that the processes still finish at the same time.
+        if self.schedule == "dynamic":
+            return [(tile, tile + 1) for tile in xrange(count)]
+
+        chunks = []
+        first = 0
+        while first < count:
+            size = max(1, int(math.ceil((count - first) / float(2 * self.num_processes))))
+            chunks.append((first, min(first + size, count)))
+            first += size
+
+        return chunks
+
+    def _process_tiles(self, process_id, shared_pixels, shared_patterns, shared_statistics, tiles, queue):
+        # Take chunks of tiles from the queue until it is empty and calculate the
+        # patterns of each tile directly into its part of the shared result buffer.
+        # In histogram only mode the process adds up the histograms of its tiles.
+        start = self.profiler.clock()
+        border = self.border
+        pixels = np.frombuffer(shared_pixels, dtype=np.uint8).reshape(self.height, self.width)
+        if self.histogram_only:
+            histogram = np.zeros(self.bins, dtype=np.int64)
+            buffer = np.empty(self._tile_size(), dtype=self.dtype)
+        else:
+            patterns = np.frombuffer(shared_patterns, dtype=self.dtype)
+            patterns = patterns.reshape(self.height - 2 * border, self.width - 2 * border)
+
+        while True:
+            chunk = queue.get()
+            if chunk is None:
+                break
+
+            for top, bottom, left, right in tiles[chunk[0]:chunk[1]]:
+                tile_pixels = pixels[top:bottom + 2 * border, left:right + 2 * border]
+                if self.kernel != "numpy":
+                    tile_pixels = tile_pixels.tolist()
+
+                if self.histogram_only:
+                    tile_patterns = self._calculate(tile_pixels, border, border + bottom - top, buffer[:bottom - top, :right - left])
+                    histogram += self._histogram(tile_patterns)
+                else:
+                    self._calculate(tile_pixels, border, border + bottom - top, patterns[top:bottom, left:right])
+
+        if self.histogram_only:
+            np.frombuffer(shared_patterns, dtype=np.int64).reshape(self.num_processes, self.bins)[process_id] = histogram
+
+        worker = self.profiler.worker(process_id, start)
+        if worker is not None:
+            statistics = np.frombuffer(shared_statistics, dtype=np.float64).reshape(self.num_processes, 2)
+            statistics[process_id] = (worker['time'], worker['memory'])
+
+    def _distribute_tiles(self):
+        # Place the image and a preallocated result buffer in shared memory and put
+        # the chunks of tiles in a queue, followed by an end marker for each process.
+        # Processes that are idle take the next chunk, so faster processes do more.
+        start = self.profiler.clock()
+        shared_pixels, shared_patterns, shared_statistics = self._share()
+        tiles = self._tiles(*self._tile_size())
+        queue = Queue()
+        for chunk in self._chunks(len(tiles)):
+            queue.put(chunk)
+
+        [queue.put(None) for process_id in xrange(self.num_processes)]
+
+        # Spawn the processes
+        processes = []
+        for process_id in xrange(self.num_processes):
+            arguments = (process_id, shared_pixels, shared_patterns, shared_statistics, tiles, queue)
+            process = Process(target=self._process_tiles, args=arguments)
+            process.start()
+            processes.append(process)
+
+        # Wait for all processes to finish
+        start = self.profiler.measure("distribute", start)
+        [process.join() for process in processes]
+        start = self.profiler.measure("compute", start)
+        self._collect(shared_patterns, shared_statistics)
+        self.profiler.measure("gather", start)
@@ -0,0 +1,47 @@
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from LBP import LBP
+
+class Multithreading_LBP(LBP):
+    def __init__(self, input, num_processes, output, **options):
+        # Always use the NumPy kernel, because the threads only run in parallel while
+        # its array operations have released the interpreter lock
+        options["kernel"] = "numpy"
+        LBP.__init__(self, input, num_processes, output, **options)
+
+    def _process(self):
+        # Divide the image into a slice for each thread of the pool. All threads share
+        # the same pixels and write the patterns of their slice directly into its rows
+        # of the result array, so nothing is copied or pickled. The array operations of
+        # the NumPy kernel release the interpreter lock, so the threads run in parallel.
+        start = self.profiler.clock()
+        pixels = self._pixels()
+        self._prepare()
+        pool = ThreadPool(self.num_processes)
+        results = pool.map(lambda process_id: self._process_segment(process_id, pixels), xrange(self.num_processes))
+        pool.close()
+        pool.join()
+        start = self.profiler.measure("compute", start)
+
+        # Merge the histograms of the slices in histogram only mode
+        for histogram, worker in results:
+            if histogram is not None:
+                self.histogram += histogram
+
+            self.profiler.record(worker)
+
+        self.profiler.measure("gather", start)
+
+    def _process_segment(self, process_id, pixels):
+        start = self.profiler.clock()
+        left_bound, right_bound = self._bounds(process_id)
+
+        # Calculate LBP for each non-edge pixel in the slice. In histogram only
+        # mode just the histogram of the slice is returned.
+        histogram = None
+        if self.histogram_only:
+            histogram = self._accumulate(pixels, left_bound, right_bound)
+        else:
+            self._calculate(pixels, left_bound, right_bound, self.patterns[left_bound - self.border:right_bound - self.border])
+
+        return (histogram, self.profiler.worker(process_id, start))
@@ -0,0 +1,10 @@
+import numpy as np
+from PIL import Image
+from LBP import LBP
+
+class NumPy_LBP(LBP):
+    def __init__(self, input, num_processes, output, **options):
+        # Always use the vectorized kernel, which computes the patterns of the
+        # entire image using shifted array comparisons instead of a pixel loop
+        options["kernel"] = "numpy"
+        LBP.__init__(self, input, num_processes, output, **options)
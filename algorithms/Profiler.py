@@ -0,0 +1,71 @@
+import json
+import time
+import resource
+
+class Profiler:
+    def __init__(self, enabled=False):
+        # When disabled, nothing is measured and every method returns immediately
+        self.enabled = enabled
+        self.started = time.time() if enabled else 0.0
+        self.timings = {}
+        self.transfers = {}
+        self.workers = []
+
+    @staticmethod
+    def memory():
+        # Peak resident set size of the current process in megabytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def clock(self):
+        # Return the current time to measure a phase from
+        return time.time() if self.enabled else 0.0
+
+    def measure(self, phase, start):
+        # Add the time since the start to the phase and return the current time,
+        # so that consecutive phases can be measured without gaps between them
+        if not self.enabled:
+            return 0.0
+
+        now = time.time()
+        self.timings[phase] = self.timings.get(phase, 0.0) + (now - start)
+        return now
+
+    def transfer(self, phase, size):
+        # Add the number of bytes sent between processes during the phase
+        if self.enabled:
+            self.transfers[phase] = self.transfers.get(phase, 0) + int(size)
+
+    def worker(self, process_id, start):
+        # Describe the work of a process that started calculating at the given time
+        if not self.enabled:
+            return None
+
+        return {'process_id': process_id, 'time': time.time() - start, 'memory': Profiler.memory()}
+
+    def record(self, worker):
+        # Add the description of the work of a process (if any) to the report
+        if worker is not None:
+            self.workers.append(worker)
+
+    def report(self, run):
+        # Summarize the run. The imbalance is the ratio of the longest to the average
+        # calculation time of the processes, so 1 means a perfectly balanced load.
+        times = [worker['time'] for worker in self.workers]
+        average = sum(times) / len(times) if times else 0.0
+        return {
+            'algorithm': run.__class__.__name__,
+            'processes': run.num_processes,
+            'width': run.width,
+            'height': run.height,
+            'elapsed': time.time() - self.started,
+            'phases': self.timings,
+            'transfers': self.transfers,
+            'workers': sorted(self.workers, key=lambda worker: worker['process_id']),
+            'imbalance': max(times) / average if average > 0 else 1.0,
+            'memory': Profiler.memory()
+        }
+
+    def write(self, run, file_name="profile.json"):
+        # Write the report of the run to a JSON file
+        with open(file_name, 'w') as output:
+            json.dump(self.report(run), output, indent=4, separators=(',', ': '), sort_keys=True)
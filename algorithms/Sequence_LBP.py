@@ -0,0 +1,97 @@
+import numpy as np
+from LBP import LBP
+
+class Sequence_LBP(LBP):
+    # Size of the tiles that are compared and recalculated, unless a tile size is given
+    TILE_SIZE = (64, 64)
+
+    def __init__(self, input, num_processes, output, **options):
+        # The input is the first frame of the sequence. Frames are only compared with the
+        # NumPy kernel, which can calculate the patterns of a single tile.
+        options["kernel"] = "numpy"
+        LBP.__init__(self, input, num_processes, output, **options)
+        if self.tile_size is None:
+            self.tile_size = Sequence_LBP.TILE_SIZE
+
+        self.pixels = None
+        self.tiles = None
+        self.skipped = 0.0
+
+    def execute(self):
+        self._process()
+        if self.output:
+            self._output()
+
+    def update(self, frame):
+        # Replace the current frame by the next frame of the sequence, which may be a file
+        # name, a decoded image or an array of grayscale or color pixels, and update the
+        # patterns and the histogram. Returns the fraction of the patterns that was not
+        # recalculated.
+        start = self.profiler.clock()
+        self._open(frame)
+        self.profiler.measure("decode", start)
+        previous = self.pixels
+        if previous is None or previous.shape != (self.height, self.width):
+            self._process()
+        else:
+            self._update(previous)
+
+        if self.output:
+            self._output()
+
+        return self.skipped
+
+    def _process(self):
+        # Calculate all patterns of the frame. The patterns are kept even in histogram
+        # only mode, because they are needed to update the histogram of later frames.
+        start = self.profiler.clock()
+        self.pixels = self._pixels()
+        self.tiles = np.array(self._tiles(*self.tile_size), dtype=np.int64).reshape(-1, 4)
+        self.patterns = self._calculate(self.pixels, self.border, self.height - self.border)
+        self.histogram = self._histogram(self.patterns)
+        self.skipped = 0.0
+        self.profiler.record(self.profiler.worker(0, start))
+        self.profiler.measure("compute", start)
+
+    def _update(self, previous):
+        # Recalculate only the tiles of which a pixel within the border around the tile
+        # has changed since the previous frame. The patterns of those tiles are replaced
+        # in the result array and the histogram is corrected for the replaced patterns.
+        start = self.profiler.clock()
+        pixels = self._pixels()
+        border = self.border
+        tiles = self._changed(np.not_equal(pixels, previous))
+        for top, bottom, left, right in tiles:
+            patterns = self.patterns[top:bottom, left:right]
+            self.histogram -= self._histogram(patterns)
+            self._calculate(pixels[top:bottom + 2 * border, left:right + 2 * border], border, border + bottom - top, patterns)
+            self.histogram += self._histogram(patterns)
+
+        self.pixels = pixels
+        recalculated = sum((bottom - top) * (right - left) for top, bottom, left, right in tiles)
+        self.skipped = 1 - recalculated / float(max(1, self.patterns.size))
+        self.profiler.record(self.profiler.worker(0, start))
+        self.profiler.measure("compute", start)
+
+    def _changed(self, changes):
+        # Return the tiles with a changed pixel. The changes are first reduced to blocks
+        # of pixels on the same grid as the tiles. The pixels of a tile also extend over
+        # the border into the blocks below and to the right, so those are combined too.
+        if not changes.any():
+            return []
+
+        tile_height, tile_width = self.tile_size
+        blocks = np.logical_or.reduceat(changes, np.arange(0, self.height, tile_height), axis=0)
+        blocks = np.logical_or.reduceat(blocks, np.arange(0, self.width, tile_width), axis=1)
+        rows = -(-(self.height - 2 * self.border) // tile_height)
+        columns = -(-(self.width - 2 * self.border) // tile_width)
+        extra_rows = -(-2 * self.border // tile_height)
+        extra_columns = -(-2 * self.border // tile_width)
+        padded = np.zeros((rows + extra_rows, columns + extra_columns), dtype=np.bool_)
+        padded[:blocks.shape[0], :blocks.shape[1]] = blocks[:rows + extra_rows, :columns + extra_columns]
+        changed = np.zeros((rows, columns), dtype=np.bool_)
+        for row in xrange(extra_rows + 1):
+            for column in xrange(extra_columns + 1):
+                changed |= padded[row:row + rows, column:column + columns]
+
+        return self.tiles[changed.ravel()].tolist()
@@ -0,0 +1,79 @@
+import numpy as np
+from PIL import Image
+from LBP import LBP
+from Profiler import Profiler
+
+class Streaming_LBP(LBP):
+    def __init__(self, input, num_processes, output, **options):
+        LBP.__init__(self, input, num_processes, output, **options)
+
+    def execute(self):
+        self._process()
+        if self.output and self.histogram_only:
+            self._output()
+
+    def _read(self, top, bottom):
+        # Read the rows in [top, bottom) of the decoded image
+        start = self.profiler.clock()
+        rows = np.asarray(self.image.crop((0, top, self.width, bottom)))
+        self.profiler.measure("decode", start)
+        return rows
+
+    def _process(self):
+        # Process the image in horizontal strips of at most the strip height. Each strip
+        # is extended with the neighboring rows on either side, where the rows above the
+        # strip are carried over from the previous strip instead of being read again.
+        # Only the patterns of a single strip are kept in memory at any time.
+        border = self.border
+        output = self._open_output() if self.output and not self.histogram_only else None
+        if self.histogram_only:
+            self.histogram = np.zeros(self.bins, dtype=np.int64)
+
+        buffer = np.empty((self.strip_height, self.width - 2 * border), dtype=self.dtype)
+        halo = self._read(0, 2 * border)
+        for top in xrange(border, self.height - border, self.strip_height):
+            bottom = min(top + self.strip_height, self.height - border)
+            pixels = np.concatenate([halo, self._read(top + border, bottom + border)])
+            halo = pixels[pixels.shape[0] - 2 * border:]
+
+            # Calculate LBP for each non-edge pixel in the strip into the reused buffer
+            start = self.profiler.clock()
+            patterns = self._calculate(pixels, border, pixels.shape[0] - border, buffer[:bottom - top])
+            if self.histogram_only:
+                self.histogram += self._histogram(patterns)
+
+            start = self.profiler.measure("compute", start)
+            if output is not None:
+                output.write(np.asarray(patterns, dtype=self._output_dtype()).tobytes())
+                self.profiler.measure("encode", start)
+
+        if output is not None:
+            output.close()
+
+        # The strips are calculated by this process only
+        if self.profiler.enabled:
+            self.profiler.record({'process_id': 0, 'time': self.profiler.timings.get("compute", 0.0), 'memory': Profiler.memory()})
+
+    def _output_dtype(self):
+        # PGM files store 16-bit values in big-endian byte order
+        if self.dtype == np.uint32:
+            return np.dtype("<u4")
+        if self.dtype == np.uint16:
+            return np.dtype(">u2")
+
+        return np.dtype("u1")
+
+    def _open_output(self):
+        # Write the result incrementally to a PGM file, or to a NumPy file for
+        # patterns of more than 16 bits, which do not fit in a PGM file
+        width = self.width - 2 * self.border
+        height = self.height - 2 * self.border
+        if self.dtype == np.uint32:
+            output = open("{}.npy".format(self.output_name or "output"), "wb")
+            header = {"descr": self._output_dtype().str, "fortran_order": False, "shape": (height, width)}
+            np.lib.format.write_array_header_1_0(output, header)
+        else:
+            output = open("{}.pgm".format(self.output_name or "output"), "wb")
+            output.write("P5\n{} {}\n{}\n".format(width, height, np.iinfo(self.dtype).max).encode("ascii"))
+
+        return output
@@ -1 +1,31 @@
-__all__ = ["LBP", "Multiprocessing_LBP", "Multiprocessing_LBP_MPI", "Multiprocessing_Split_LBP"]
+import importlib
+
+# Each variant is declared by its name and the location of the class that implements
+# it as "module:class". The module is only imported when the variant is used, so that
+# optional dependencies such as mpi4py are only needed by the variants that use them.
+BACKENDS = {
+    "lbp": "algorithms.LBP:LBP",
+    "numpy-lbp": "algorithms.NumPy_LBP:NumPy_LBP",
+    "stream-lbp": "algorithms.Streaming_LBP:Streaming_LBP",
+    "multi-lbp": "algorithms.Multiprocessing_LBP:Multiprocessing_LBP",
+    "multi-lbp-mpi": "algorithms.Multiprocessing_LBP_MPI:Multiprocessing_LBP_MPI",
+    "multi-split-lbp": "algorithms.Multiprocessing_Split_LBP:Multiprocessing_Split_LBP",
+    "multi-tile-lbp": "algorithms.Multiprocessing_Tiled_LBP:Multiprocessing_Tiled_LBP",
+    "multi-thread-lbp": "algorithms.Multithreading_LBP:Multithreading_LBP",
+    "sequence-lbp": "algorithms.Sequence_LBP:Sequence_LBP"
+}
+
+def register(name, location):
+    # Declare a variant, which may also be implemented outside of this package. The
+    # location is either "module:class" to import it when used, or the class itself.
+    BACKENDS[name] = location
+
+def load(name):
+    # Return the class that implements the variant, importing its module if needed.
+    # Raises an ImportError if the module or one of its dependencies is missing.
+    location = BACKENDS[name]
+    if not isinstance(location, basestring):
+        return location
+
+    module_name, class_name = location.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
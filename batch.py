@@ -0,0 +1,125 @@
+import os
+import glob
+from multiprocessing import Pool
+from PIL import Image
+from algorithms.LBP import LBP
+from algorithms.NumPy_LBP import NumPy_LBP
+from cache import Cache
+
+def process(segment, options):
+    # Calculate the result of one segment of a large image in a worker process. The
+    # segment includes the neighboring rows on either side, so only the patterns of
+    # its own rows are calculated. This is a module level function, because only
+    # those can be sent to a pool.
+    run = NumPy_LBP(segment, 1, False, **options)
+    run.execute()
+    return run.histogram if run.histogram_only else run.patterns
+
+def process_image(input, output_name, options, cache):
+    # Run LBP on an entire image in a worker process and write its output, unless
+    # the result is already cached. Only whether it was cached is sent back.
+    if cache is not None:
+        key = Cache.key(input, options)
+        result = cache.load(key)
+        if result is not None:
+            LBP.save(result, output_name)
+            return True
+
+    run = NumPy_LBP(input, 1, True, output_name=output_name, **options)
+    run.execute()
+    if cache is not None:
+        cache.store(key, run.histogram if run.histogram_only else run.patterns)
+        return False
+
+class Batch:
+    def __init__(self, inputs, target, num_processes, threshold, options, cache=None):
+        self.inputs = inputs
+        self.target = target
+        self.num_processes = num_processes
+        self.threshold = threshold
+        self.options = options
+        self.cache = cache
+
+    @staticmethod
+    def collect(directory=None, pattern=None, list_file=None):
+        # Collect the input images from a directory, a glob pattern or a file
+        # that contains the file name of one image on each line
+        inputs = []
+        if directory is not None:
+            inputs.extend(sorted(os.path.join(directory, name) for name in os.listdir(directory)))
+        if pattern is not None:
+            inputs.extend(sorted(glob.glob(pattern)))
+        if list_file is not None:
+            with open(list_file) as file:
+                inputs.extend(line.strip() for line in file if line.strip())
+
+        return [input for input in inputs if os.path.isfile(input)]
+
+    def execute(self):
+        # Keep a single pool of worker processes alive for all images. Small images
+        # are processed concurrently, with each worker processing an entire image,
+        # while large images are divided over all workers one at a time. Files that
+        # can not be processed are reported and skipped, so the batch continues.
+        pool = Pool(self.num_processes)
+        pending = []
+        for input in self.inputs:
+            try:
+                width, height = Image.open(input).size
+            except IOError as error:
+                print("Skipping '{}': {}".format(input, error))
+                continue
+
+            if width * height < self.threshold or self.num_processes == 1:
+                pending.append((input, pool.apply_async(process_image, (input, self._output_name(input), self.options, self.cache))))
+            else:
+                try:
+                    self._split(pool, input)
+                except Exception as error:
+                    print("Failed to process '{}': {}".format(input, error))
+
+        # The workers have their own copy of the cache, so count their hits and misses here
+        for input, result in pending:
+            try:
+                hit = result.get()
+            except Exception as error:
+                print("Failed to process '{}': {}".format(input, error))
+                continue
+
+            if hit is not None:
+                self.cache.hits += hit
+                self.cache.misses += not hit
+
+        pool.close()
+        pool.join()
+
+    def _split(self, pool, input):
+        # Pass each worker the slice of the image it should process, including
+        # the neighboring rows on either side, and write the patterns of each
+        # slice into its rows of the result array.
+        if self.cache is not None:
+            key = Cache.key(input, self.options)
+            result = self.cache.load(key)
+            if result is not None:
+                LBP.save(result, self._output_name(input))
+                return
+
+        run = NumPy_LBP(input, self.num_processes, True, output_name=self._output_name(input), **self.options)
+        pixels = run._pixels()
+        results = []
+        for process_id in xrange(self.num_processes):
+            left_bound, right_bound = run._bounds(process_id)
+            segment_pixels = pixels[left_bound - run.border:right_bound + run.border]
+            results.append(pool.apply_async(process, (segment_pixels, self.options)))
+
+        run._prepare()
+        for process_id, result in enumerate(results):
+            run._store(process_id, result.get())
+
+        run._output()
+        if self.cache is not None:
+            self.cache.store(key, run.histogram if run.histogram_only else run.patterns)
+
+    def _output_name(self, input):
+        # Name the output after the input image, but in the target directory
+        name = os.path.splitext(os.path.basename(input))[0]
+        return os.path.join(self.target, name)
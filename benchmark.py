@@ -1,44 +1,45 @@
+import os
 import sys
-import multiprocessing
-import subprocess
+import math
+import time
 import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-class Results:
-    def __init__(self):
-        self.results = {
-            'lbp': [],
-            'multi-lbp': [],
-            'multi-split-lbp': [],
-            'multi-lbp-mpi': []
-        }
-
-    def get(self):
-        return self.results
-
-    def append(self, category, cores, output):
-        result = self._parse(output, cores)
-        self.results[category].append(result)
-
-    def _parse(self, output, cores):
-        result = {
-            'cores': cores,
-            'real_time': 0,
-            'user_sys_time': 0,
-            'memory': 0
-        }
-        line = output.readline()
-        measurements = line.split('-')
-        result['real_time'] = float(measurements[0])
-        result['user_sys_time'] = float(measurements[1]) + float(measurements[2])
-        result['memory'] += (int(measurements[3]) / 4) / 1000 # Convert kB to MB
-        return result
+from PIL import Image
+import algorithms
+from algorithms.Profiler import Profiler
+
+# Each category is a variant with its options. Variants that use a single process
+# are only benchmarked with one process. The regular variant always uses the Python
+# kernel, so that it remains the pure Python baseline whatever --kernel is.
+CATEGORIES = [
+    ('lbp', 'lbp', {'kernel': 'python'}, True),
+    ('numpy-lbp', 'numpy-lbp', {}, True),
+    ('stream-lbp', 'stream-lbp', {}, True),
+    ('multi-lbp', 'multi-lbp', {}, False),
+    ('multi-split-lbp', 'multi-split-lbp', {}, False),
+    ('multi-lbp-shared', 'multi-lbp', {'shared_memory': True}, False),
+    ('multi-split-lbp-shared', 'multi-split-lbp', {'shared_memory': True}, False),
+    ('multi-tile-lbp', 'multi-tile-lbp', {}, False),
+    ('multi-tile-lbp-guided', 'multi-tile-lbp', {'schedule': 'guided'}, False),
+    ('multi-thread-lbp', 'multi-thread-lbp', {}, False),
+    ('multi-lbp-mpi', 'multi-lbp-mpi', {}, False)
+]
+
+PHASES = ['decode', 'distribute', 'compute', 'gather', 'encode']
 
 class Plot:
     def __init__(self, results):
+        # Matplotlib is only imported when plotting, so the processes that measure
+        # the configurations do not have to import it
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        self.plt = plt
         self.results = results
         self.bar_width = 0.5
 
@@ -47,15 +48,15 @@ class Plot:
         real_time = ()
         memory = ()
         for item in runs:
-            real_time += (item['real_time'],)
-            memory += (item['memory'],)
+            real_time += (item['time']['median'],)
+            memory += (max([item['memory']] + [worker['memory'] for worker in item['workers']]),)
 
         return (real_time, memory)
 
-    def _create(self, data, algorithm, runs, label, file_name):
+    def _create(self, data, title, runs, label, file_name):
         # Create the initial plot
         x_groups = np.arange(len(runs))
-        fig, ax = plt.subplots()
+        fig, ax = self.plt.subplots()
 
         # Add the bars
         ax.bar(x_groups, data, self.bar_width, color='b', alpha=0.5, align='center')
@@ -63,71 +64,255 @@ class Plot:
         # Set the labels and ticks
         ax.set_xlabel('Number of processes')
         ax.set_ylabel(label)
-        ax.set_title(algorithm)
+        ax.set_title(title)
         ax.set_xticks(x_groups)
-        ax.set_xticklabels(range(1, multiprocessing.cpu_count() + 1))
-        
+        ax.set_xticklabels([item['processes'] for item in runs])
+
         # Add a grid and save the plot
-        plt.grid(True)
-        plt.savefig(file_name)
+        self.plt.grid(True)
+        self.plt.savefig(file_name)
+        self.plt.close(fig)
 
     def output(self):
-        for algorithm, runs in self.results.iteritems():
+        # Create a plot for each category and image size over the numbers of processes
+        groups = {}
+        for result in self.results.values():
+            groups.setdefault((result['category'], result['megapixels']), []).append(result)
+
+        for (category, megapixels), runs in groups.items():
+            runs.sort(key=lambda item: item['processes'])
+            title = '{} ({} MP)'.format(category, megapixels)
+            name = 'benchmark_plot_{}_{}MP'.format(category, megapixels)
             real_time, memory = self._preprocess(runs)
-            self._create(real_time, algorithm, runs, 'Real time (seconds)', 'benchmark_plot_{}_real_time.eps'.format(algorithm))
-            self._create(memory, algorithm, runs, 'Peak memory usage (MB)', 'benchmark_plot_{}_memory.eps'.format(algorithm))
-
-def run(algorithm, cores, results):
-    if algorithm == "multi-lbp-mpi":
-        process = subprocess.Popen(
-            [
-                '/usr/bin/time',
-                '-f', '%e-%S-%U-%M',
-                'mpirun', '-np', str(cores + 1), sys.executable, 'main.py', '--input', 'images/1.jpeg', '--algorithm', algorithm, '--processes', str(cores)
-            ],
-            stderr=subprocess.PIPE
-        )
-    else:
-        process = subprocess.Popen(
-            [
-                '/usr/bin/time',
-                '-f', '%e-%S-%U-%M',
-                sys.executable, 'main.py', '--input', 'images/1.jpeg', '--algorithm', algorithm, '--processes', str(cores)
-            ],
-            stderr=subprocess.PIPE
-        )
-    
-    results.append(algorithm, cores, process.stderr)
+            self._create(real_time, title, runs, 'Median real time (seconds)', '{}_real_time.eps'.format(name))
+            self._create(memory, title, runs, 'Peak memory usage (MB)', '{}_memory.eps'.format(name))
+
+def synthesize(directory, megapixels):
+    # Generate an image of the given size with a fixed seed, so that every run of the
+    # benchmark processes exactly the same pixels. The image consists of smooth shapes
+    # with a little noise, which compresses and decodes more like a photo than noise.
+    width = int(round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(megapixels * 1e6 / width))
+    path = os.path.join(directory, 'synthetic_{}x{}.png'.format(width, height))
+    if os.path.exists(path):
+        return path
+
+    random = np.random.RandomState(0)
+    coarse = random.randint(0, 256, (height // 16 + 1, width // 16 + 1)).astype(np.uint8)
+    pixels = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR))
+    noise = np.frombuffer(random.bytes(width * height), dtype=np.uint8).reshape(height, width) & 15
+    pixels = pixels - pixels // 16 + noise
+    Image.fromarray(pixels).save(path)
+    return path
+
+def statistics(values):
+    # Summarize the repetitions by their median and 95th percentile
+    return {
+        'median': float(np.median(values)),
+        'p95': float(np.percentile(values, 95))
+    }
+
+def startup(algorithm, repetitions=3):
+    # Measure the median time it takes to start a new Python process and import the
+    # variant, which is the fixed cost of every run of main.py before any work is done
+    command = [sys.executable, '-c', 'import algorithms; algorithms.load("{}")'.format(algorithm)]
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for repetition in xrange(repetitions):
+        start = time.time()
+        subprocess.check_call(command, cwd=directory)
+        times.append(time.time() - start)
+
+    return float(np.median(times))
+
+def measure(configuration):
+    # Run a configuration a number of times in this process. The warm-up runs are
+    # not recorded, so that imports and lookup tables do not affect the results.
+    start = time.time()
+    algorithm = algorithms.load(configuration['algorithm'])
+    imported = time.time() - start
+    samples = []
+    for repetition in xrange(configuration['warmup'] + configuration['repetitions']):
+        start = time.time()
+        run = algorithm(configuration['image'], configuration['processes'], True, output_name=configuration['output_name'],
+                        profile=True, **configuration['options'])
+        run.execute()
+        elapsed = time.time() - start
+
+        if repetition >= configuration['warmup']:
+            samples.append({'time': elapsed, 'phases': run.profiler.timings, 'workers': run.profiler.workers})
+
+    return {'samples': samples, 'memory': Profiler.memory(), 'import': imported}
+
+def run(configuration):
+    # Measure the configuration in a new process, so that the peak memory usage
+    # only covers this configuration, and summarize the repetitions
+    command = [sys.executable, os.path.abspath(__file__), '--measure', json.dumps(configuration)]
+    if configuration['algorithm'] == 'multi-lbp-mpi':
+        command = ['mpirun', '-np', str(configuration['processes'])] + command
+
+    output = subprocess.check_output(command)
+    measurement = json.loads(output.splitlines()[-1])
+    samples = measurement['samples']
+
+    workers = {}
+    for sample in samples:
+        for worker in sample['workers']:
+            workers.setdefault(worker['process_id'], []).append(worker)
+
+    return {
+        'category': configuration['category'],
+        'megapixels': configuration['megapixels'],
+        'processes': configuration['processes'],
+        'time': statistics([sample['time'] for sample in samples]),
+        'phases': dict(
+            (phase, statistics([sample['phases'].get(phase, 0.0) for sample in samples])) for phase in PHASES
+        ),
+        'memory': measurement['memory'],
+        'import': measurement['import'],
+        'workers': [
+            {
+                'process_id': process_id,
+                'time': statistics([worker['time'] for worker in workers[process_id]]),
+                'memory': max(worker['memory'] for worker in workers[process_id])
+            }
+            for process_id in sorted(workers)
+        ]
+    }
+
+def compare(results, baseline, threshold):
+    # Report the configurations whose median time has increased by more than the
+    # threshold compared to the baseline. New configurations are not compared.
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline['results']:
+            continue
+
+        before = baseline['results'][key]['time']['median']
+        after = result['time']['median']
+        if after > before * (1 + threshold):
+            regressions.append(key)
+            print("Regression in {}: {:.3f} to {:.3f} seconds (+{:.0%})".format(key, before, after, after / before - 1))
+
+    return regressions
 
 def main():
-    results = Results()
-    
-    cpu_count = multiprocessing.cpu_count()
-    for cores in range(1, cpu_count + 1):
-        # LBP
-        if cores == 1:
-            print("Benchmarking LBP...")
-            run("lbp", cores, results)
-
-        # Multiprocessing LBP
-        print("Benchmarking multiprocessing LBP with {} cores...".format(cores))
-        run("multi-lbp", cores, results)
-
-        # Multiprocessing split LBP
-        print("Benchmarking multiprocessing split LBP with {} cores...".format(cores))
-        run("multi-split-lbp", cores, results)
-
-        # Multiprocessing LBP (MPI)
-        print("Benchmarking multiprocessing LBP (MPI) with {} cores...".format(cores))
-        run("multi-lbp-mpi", cores, results)
+    # Argument parsing
+    parser = argparse.ArgumentParser(description='Benchmark the local binary patterns variants on synthetic images.')
+    parser.add_argument('--sizes', dest='sizes', type=float, nargs='+', default=[0.25, 1, 4, 16, 64, 100], help='sizes of the synthetic images in megapixels')
+    parser.add_argument('--processes', dest='processes', type=int, nargs='+', default=range(1, multiprocessing.cpu_count() + 1), help='numbers of processes to benchmark the multiprocessing variants with')
+    parser.add_argument('--categories', dest='categories', type=str, nargs='+', default=[category[0] for category in CATEGORIES], help='variants to benchmark')
+    parser.add_argument('--kernel', dest='kernel', type=str, default='numpy', help='kernel to calculate the patterns with: "python" or "numpy", except for lbp, which always uses the Python kernel')
+    parser.add_argument('--warmup', dest='warmup', type=int, default=1, help='number of runs before the measured runs')
+    parser.add_argument('--repetitions', dest='repetitions', type=int, default=5, help='number of measured runs of each configuration')
+    parser.add_argument('--image-dir', dest='image_dir', type=str, default='benchmark_images', help='directory for storing the synthetic images')
+    parser.add_argument('--output', dest='output', type=str, default='benchmark_results.json', help='file name of the results JSON')
+    parser.add_argument('--baseline', dest='baseline', type=str, default=None, help='file name of a results JSON to compare the results to')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.1, help='relative increase of the median time that is considered a regression')
+    parser.add_argument('--plot', dest='plot', action='store_true', default=False, help='whether or not plots of the results should be created')
+    parser.add_argument('--measure', dest='measure', type=str, default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure is not None:
+        # Measure a single configuration for the main benchmark process. With MPI
+        # only the root process has the results of all processes.
+        configuration = json.loads(arguments.measure)
+        measurement = measure(configuration)
+        if configuration['algorithm'] == 'multi-lbp-mpi':
+            from mpi4py import MPI
+            if MPI.COMM_WORLD.rank != 0:
+                return
+
+        print(json.dumps(measurement))
+
+        return
+
+    for category in arguments.categories:
+        if category not in [name for name, algorithm, options, single in CATEGORIES]:
+            print("Invalid category '{}'".format(category))
+            return
+
+    if arguments.kernel not in ["python", "numpy"]:
+        print("Invalid kernel '{}'".format(arguments.kernel))
+        return
+
+    if not os.path.exists(arguments.image_dir):
+        os.makedirs(arguments.image_dir)
+
+    # Measure the startup time of each variant first. Variants of which the
+    # dependencies are not installed are left out of the benchmark.
+    startup_times = {}
+    for name, algorithm, options, single in CATEGORIES:
+        if name not in arguments.categories or algorithm in startup_times:
+            continue
+
+        try:
+            startup_times[algorithm] = startup(algorithm)
+        except subprocess.CalledProcessError:
+            print("Skipping {}: it can not be imported".format(algorithm))
+            continue
+
+        print("Startup time of {}: {:.3f} s".format(algorithm, startup_times[algorithm]))
+
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for megapixels in arguments.sizes:
+            print("Generating synthetic image of {} MP...".format(megapixels))
+            image = synthesize(arguments.image_dir, megapixels)
+
+            for name, algorithm, options, single in CATEGORIES:
+                if name not in arguments.categories or algorithm not in startup_times:
+                    continue
+
+                for processes in ([1] if single else arguments.processes):
+                    print("Benchmarking {} on {} MP with {} processes...".format(name, megapixels, processes))
+                    configuration = {
+                        'category': name,
+                        'algorithm': algorithm,
+                        'options': dict({'kernel': arguments.kernel}, **options),
+                        'image': image,
+                        'megapixels': megapixels,
+                        'processes': processes,
+                        'warmup': arguments.warmup,
+                        'repetitions': arguments.repetitions,
+                        'output_name': os.path.join(directory, 'output')
+                    }
+                    try:
+                        result = run(configuration)
+                    except (OSError, subprocess.CalledProcessError) as error:
+                        print("Skipping {}: {}".format(name, error))
+                        continue
+
+                    results['{}/{}MP/{}p'.format(name, megapixels, processes)] = result
+                    print("    median {:.3f} s, p95 {:.3f} s, {}".format(
+                        result['time']['median'], result['time']['p95'],
+                        ", ".join("{} {:.3f} s".format(phase, result['phases'][phase]['median']) for phase in PHASES)
+                    ))
+    finally:
+        shutil.rmtree(directory)
 
     print("Writing results JSON...")
-    with open('benchmark_results.json', 'w') as output:
-        json.dump(results.get(), output, indent=4, separators=(',', ': '))
+    with open(arguments.output, 'w') as output:
+        json.dump({
+            'kernel': arguments.kernel,
+            'warmup': arguments.warmup,
+            'repetitions': arguments.repetitions,
+            'startup': startup_times,
+            'results': results
+        }, output, indent=4, separators=(',', ': '), sort_keys=True)
+
+    if arguments.plot:
+        print("Writing plot EPSs...")
+        plot = Plot(results)
+        plot.output()
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), arguments.threshold)
 
-    print("Writing plot SVGs...")
-    plot = Plot(results.get())
-    plot.output()
+        if regressions:
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
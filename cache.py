@@ -0,0 +1,88 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+class Cache:
+    # Version of the results, which changes when the results of the same parameters change,
+    # such as when JPEG images started to be decoded to grayscale directly from their luma
+    VERSION = 2
+
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(input, options):
+        # Identify a result by the contents of the image file and the parameters
+        # that influence the result, so renamed or copied images are also found
+        digest = hashlib.sha1()
+        with open(input, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+
+        parameters = "{}-{}-{}-{}-{}".format(
+            Cache.VERSION, options.get("points", 8), float(options.get("radius", 1)), options.get("mapping", "none"),
+            "histogram" if options.get("histogram_only", False) else "patterns"
+        )
+        digest.update(parameters.encode("ascii"))
+        return digest.hexdigest()
+
+    def load(self, key):
+        # Return the cached result for the key, or None if it is not cached. The
+        # modification time of the file marks when the result was last used.
+        path = self._path(key)
+        try:
+            result = np.load(path)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return result
+
+    def store(self, key, result):
+        # Write the result in NumPy's binary format to a temporary file first, so
+        # that concurrent processes never read a partially written result
+        descriptor, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as file:
+            np.save(file, result)
+
+        os.rename(path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        # Remove the least recently used results until the cache fits its capacity
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+
+            entries.append((status.st_mtime, status.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for modified, entry_size, name in sorted(entries):
+            if size <= self.capacity:
+                break
+
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                # Another process has already removed it
+                pass
+
+            size -= entry_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.npy'.format(key))
@@ -0,0 +1,227 @@
+import os
+import json
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+from algorithms.NumPy_LBP import NumPy_LBP
+from cache import Cache
+
+def extract(input, options, cache):
+    # Calculate the normalized histogram of a single image in a worker process. The pool
+    # of Gallery.extract refers to it by name, which is why it is not part of the class.
+    options = dict(options, histogram_only=True)
+    key = Cache.key(input, options) if cache is not None else None
+    histogram = cache.load(key) if cache is not None else None
+    if histogram is None:
+        run = NumPy_LBP(input, 1, False, **options)
+        run.execute()
+        histogram = run.histogram
+        if cache is not None:
+            cache.store(key, histogram)
+
+    return (histogram / float(max(histogram.sum(), 1))).astype(np.float32)
+
+def chi_square(queries, histograms):
+    # Chi-square distance between each query and each histogram, where bins that
+    # are empty in both histograms do not contribute to the distance
+    sums = queries[:, np.newaxis, :] + histograms[np.newaxis, :, :]
+    differences = queries[:, np.newaxis, :] - histograms[np.newaxis, :, :]
+    np.square(differences, out=differences)
+    np.divide(differences, sums, out=differences, where=sums > 0)
+    return differences.sum(axis=2)
+
+def intersection(queries, histograms):
+    # One minus the histogram intersection, so that identical histograms have distance zero
+    return 1 - np.minimum(queries[:, np.newaxis, :], histograms[np.newaxis, :, :]).sum(axis=2)
+
+def l1(queries, histograms):
+    # Sum of the absolute differences between the bins
+    return np.abs(queries[:, np.newaxis, :] - histograms[np.newaxis, :, :]).sum(axis=2)
+
+class Gallery:
+    DISTANCES = {
+        "chi-square": chi_square,
+        "intersection": intersection,
+        "l1": l1
+    }
+
+    # Maximum size of the temporary arrays of a single block of distance calculations
+    BLOCK_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, histograms, labels, options, centroids=None, offsets=None):
+        self.histograms = histograms
+        self.labels = labels
+        self.options = options
+        self.centroids = centroids
+        self.offsets = offsets
+
+    @staticmethod
+    def collect(directory):
+        # Collect the images of a training directory, which has a subdirectory with
+        # the images of each label, and the label of each image
+        inputs = []
+        labels = []
+        for label in sorted(os.listdir(directory)):
+            path = os.path.join(directory, label)
+            if not os.path.isdir(path):
+                continue
+
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    inputs.append(os.path.join(path, name))
+                    labels.append(label)
+
+        return (inputs, labels)
+
+    @staticmethod
+    def extract(inputs, options, num_processes, cache=None):
+        # Calculate the normalized histograms of the images with a pool of processes and
+        # return them as the rows of a single matrix, together with the inputs that they
+        # belong to. Files that can not be processed are reported and skipped.
+        pool = Pool(num_processes)
+        pending = [(input, pool.apply_async(extract, (input, options, cache))) for input in inputs]
+        histograms = []
+        succeeded = []
+        for input, result in pending:
+            try:
+                histograms.append(result.get())
+            except Exception as error:
+                print("Skipping '{}': {}".format(input, error))
+                continue
+
+            succeeded.append(input)
+
+        pool.close()
+        pool.join()
+        return (np.array(histograms, dtype=np.float32), succeeded)
+
+    @staticmethod
+    def train(directory, options, num_processes, cache=None):
+        # Only the labels of the images that could be processed are kept
+        inputs, labels = Gallery.collect(directory)
+        options = dict(options, histogram_only=True)
+        histograms, succeeded = Gallery.extract(inputs, options, num_processes, cache)
+        succeeded = set(succeeded)
+        labels = [label for input, label in zip(inputs, labels) if input in succeeded]
+        return Gallery(histograms, labels, options)
+
+    @staticmethod
+    def load(directory):
+        # The histograms are memory-mapped, so only the parts that are searched are read
+        with open(os.path.join(directory, "gallery.json")) as file:
+            description = json.load(file)
+
+        histograms = np.load(os.path.join(directory, "histograms.npy"), mmap_mode="r")
+        centroids = None
+        offsets = None
+        if description["offsets"] is not None:
+            centroids = np.load(os.path.join(directory, "centroids.npy"))
+            offsets = np.array(description["offsets"], dtype=np.int64)
+
+        return Gallery(histograms, description["labels"], description["options"], centroids, offsets)
+
+    def save(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        np.save(os.path.join(directory, "histograms.npy"), np.asarray(self.histograms, dtype=np.float32))
+        if self.centroids is not None:
+            np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+
+        with open(os.path.join(directory, "gallery.json"), "w") as file:
+            json.dump({
+                "labels": self.labels,
+                "options": self.options,
+                "offsets": self.offsets.tolist() if self.offsets is not None else None
+            }, file)
+
+    def index(self, clusters, iterations=10):
+        # Build a coarse index by clustering the histograms with k-means. The square roots
+        # of the histograms are clustered, because the Euclidean distance between those
+        # approximates the chi-square distance between the histograms. The histograms are
+        # reordered by cluster, so the histograms of each cluster are a contiguous block.
+        points = np.sqrt(np.asarray(self.histograms, dtype=np.float32))
+        clusters = max(1, min(clusters, len(points)))
+        random = np.random.RandomState(0)
+        centroids = points[random.choice(len(points), clusters, replace=False)]
+        for iteration in xrange(iterations):
+            assignments = self._nearest(points, centroids)
+            for cluster in xrange(clusters):
+                members = points[assignments == cluster]
+                if len(members) > 0:
+                    centroids[cluster] = members.mean(axis=0)
+
+        assignments = self._nearest(points, centroids)
+        order = np.argsort(assignments, kind="mergesort")
+        self.histograms = np.asarray(self.histograms)[order]
+        self.labels = [self.labels[row] for row in order]
+        self.centroids = centroids
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=clusters))]).astype(np.int64)
+
+    def _nearest(self, points, centroids):
+        # Return the index of the nearest centroid of each point, in blocks of points
+        squared_centroids = (centroids ** 2).sum(axis=1)
+        block = max(1, Gallery.BLOCK_SIZE // (4 * len(centroids)))
+        assignments = np.empty(len(points), dtype=np.int64)
+        for start in xrange(0, len(points), block):
+            distances = squared_centroids - 2 * np.dot(points[start:start + block], centroids.T)
+            assignments[start:start + block] = distances.argmin(axis=1)
+
+        return assignments
+
+    def search(self, queries, neighbors=1, distance="chi-square", probes=None):
+        # Find the nearest histograms of each query. Without an index, or if the number
+        # of clusters to probe is not given, all histograms are compared to the queries.
+        # Otherwise only the histograms of the clusters nearest to each query are.
+        queries = np.asarray(queries, dtype=np.float32)
+        best_distances = np.full((len(queries), neighbors), np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), neighbors), -1, dtype=np.int64)
+        if self.centroids is None or probes is None:
+            self._scan(queries, np.arange(len(queries)), 0, len(self.histograms), distance, best_distances, best_indices)
+            return (best_indices, best_distances)
+
+        # Compare the queries that probe a cluster to the histograms of that cluster at once
+        # Empty clusters are never probed, so each query probes at least one histogram
+        distances = self._distances(np.sqrt(queries), self.centroids)
+        distances[:, self.offsets[1:] == self.offsets[:-1]] = np.inf
+        nearest = np.argsort(distances, axis=1)[:, :probes]
+        for cluster in np.unique(nearest):
+            members = np.nonzero((nearest == cluster).any(axis=1))[0]
+            self._scan(queries[members], members, self.offsets[cluster], self.offsets[cluster + 1], distance,
+                       best_distances, best_indices)
+
+        return (best_indices, best_distances)
+
+    def _distances(self, points, centroids):
+        # Squared Euclidean distance between each point and each centroid
+        return (points ** 2).sum(axis=1)[:, np.newaxis] - 2 * np.dot(points, centroids.T) + (centroids ** 2).sum(axis=1)
+
+    def _scan(self, queries, rows, first, last, distance, best_distances, best_indices):
+        # Compare the queries to the histograms in [first, last) in blocks that keep the
+        # temporary arrays small, and merge the distances into the nearest neighbors of
+        # the queries, which are given by their rows in the best distances and indices
+        function = Gallery.DISTANCES[distance]
+        bins = self.histograms.shape[1]
+        neighbors = best_distances.shape[1]
+        block = max(1, Gallery.BLOCK_SIZE // (2 * 4 * bins * max(1, len(queries))))
+        selection = np.arange(len(rows))[:, np.newaxis]
+        for start in xrange(first, last, block):
+            end = min(start + block, last)
+            distances = np.concatenate([best_distances[rows], function(queries, np.asarray(self.histograms[start:end]))], axis=1)
+            indices = np.concatenate([best_indices[rows], np.tile(np.arange(start, end), (len(rows), 1))], axis=1)
+            nearest = np.argpartition(distances, neighbors - 1, axis=1)[:, :neighbors]
+            best_distances[rows] = distances[selection, nearest]
+            best_indices[rows] = indices[selection, nearest]
+
+    def classify(self, queries, neighbors=1, distance="chi-square", probes=None):
+        # Label each query by a majority vote of its nearest neighbors, where ties are
+        # broken in favor of the label of the nearest neighbor among the tied labels
+        indices, distances = self.search(queries, neighbors, distance, probes)
+        labels = []
+        for query_indices, query_distances in zip(indices, distances):
+            order = [index for distance, index in sorted(zip(query_distances, query_indices)) if index >= 0]
+            votes = Counter(self.labels[index] for index in order)
+            most = max(votes.values())
+            labels.append(next(self.labels[index] for index in order if votes[self.labels[index]] == most))
+
+        return labels
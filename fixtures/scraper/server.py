@@ -0,0 +1,70 @@
+import os
+import re
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import argparse
+
+# The grid pages and images that are served, which are stored next to this script
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections open between requests, like the real website does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # Serve the grid pages, redirect the download address of a photo to its image
+        # like the real website does, and serve the images. The page after the last
+        # page and images that do not exist are not found.
+        parts = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(parts.query)
+        download = re.match(r'^/photos/([\w-]+)/download$', parts.path)
+        image = re.match(r'^/images/([\w-]+\.jpg)$', parts.path)
+        if parts.path == '/grid' and query.get('page', [''])[0].isdigit():
+            self._send_file(os.path.join(FIXTURES, 'grid', '{}.html'.format(int(query['page'][0]))), 'text/html')
+        elif download is not None:
+            self._send(302, '', 'text/plain', {'Location': '/images/{}.jpg'.format(download.group(1))})
+        elif image is not None:
+            self._send_file(os.path.join(FIXTURES, 'images', image.group(1)), 'image/jpeg')
+        else:
+            self._send(404, 'Not found', 'text/plain')
+
+    def _send_file(self, path, content_type):
+        if not os.path.isfile(path):
+            self._send(404, 'Not found', 'text/plain')
+            return
+
+        with open(path, 'rb') as file:
+            self._send(200, file.read(), content_type)
+
+    def _send(self, status, body, content_type, headers={}):
+        # The length of the body must be sent for the connection to stay open
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Handle each connection in its own thread, because every scraper thread keeps its
+    # own connection open
+    daemon_threads = True
+
+def main():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description='Serve the fixture grid pages and images as a local stand-in for the website.')
+    parser.add_argument('--port', dest='port', type=int, default=8000, help='port to listen on')
+    arguments = parser.parse_args()
+
+    server = Server(('localhost', arguments.port), Handler)
+    print("Serving the fixtures on http://localhost:{}".format(arguments.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
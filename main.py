@@ -1,33 +1,341 @@
-import os.path
+import os
+import time
 import argparse
-from algorithms import *
+import importlib
+import numpy as np
+import algorithms
+from algorithms.LBP import LBP
+from cache import Cache
+from PIL import Image
+
+def parse_size(text):
+    # Parse a size given as "HEIGHTxWIDTH" or a single number for a square, or return None if it is invalid
+    try:
+        size = tuple(int(value) for value in text.split('x'))
+    except ValueError:
+        return None
+
+    if len(size) == 1:
+        size = size * 2
+
+    if len(size) != 2 or min(size) < 1:
+        return None
+
+    return size
+
+def features(arguments, patterns):
+    # Write the concatenated histograms of a grid of cells and the histograms of sliding
+    # windows. The cells are counted directly, while the windows overlap and are taken
+    # from integral histograms of strips of the patterns.
+    from algorithms.Integral_Histogram import Integral_Histogram
+    bins = int(LBP.map(arguments.mapping, arguments.points).max()) + 1
+    if arguments.grid is not None:
+        np.savetxt("grid.txt", Integral_Histogram.cells(patterns, bins, *parse_size(arguments.grid)), fmt="%d")
+
+    if arguments.windows is not None:
+        # Each line holds the top, left, bottom and right of a window followed by its histogram
+        height, width = parse_size(arguments.windows)
+        memory = arguments.window_memory * 1024 * 1024
+        with open("windows.txt", "w") as file:
+            for boxes, histograms in Integral_Histogram.sliding(patterns, bins, height, width, arguments.window_stride, memory):
+                np.savetxt(file, np.column_stack([boxes, histograms]), fmt="%d")
 
 def main():
     # Argument parsing
     parser = argparse.ArgumentParser(description='Run the local binary patterns algorithm using either a single process or multiple processes.')
     parser.add_argument('--input', dest='input', type=str, default='input.png', help='file name of the input image')
-    parser.add_argument('--algorithm', dest='algorithm', type=str, default='lbp', help='algorithm to use: "lbp", "multi-lbp" or "multi-split-lbp"')
-    parser.add_argument('--processes', dest='processes', type=int, default=1, help='number of processes to use (only relevant for multiprocessing)')
+    parser.add_argument('--algorithm', dest='algorithm', type=str, default='lbp', help='algorithm to use: "lbp", "numpy-lbp", "stream-lbp", "multi-lbp", "multi-split-lbp", "multi-tile-lbp", "multi-thread-lbp", "sequence-lbp", "multi-lbp-mpi" or "auto" to select the fastest variant and number of processes for the image')
+    parser.add_argument('--processes', dest='processes', type=int, default=1, help='number of processes (or threads for "multi-thread-lbp") to use (only relevant for multiprocessing)')
+    parser.add_argument('--kernel', dest='kernel', type=str, default='python', help='kernel to calculate the patterns with: "python" or "numpy"')
+    parser.add_argument('--shared-memory', dest='shared_memory', action='store_true', default=False, help='whether or not the image and patterns should be shared between processes instead of copied (only relevant for "multi-lbp" and "multi-split-lbp")')
+    parser.add_argument('--points', dest='points', type=int, default=8, help='number of sample points in the neighborhood of each pixel (at most 32)')
+    parser.add_argument('--radius', dest='radius', type=float, default=1, help='radius of the neighborhood of each pixel')
+    parser.add_argument('--mapping', dest='mapping', type=str, default='none', help='mapping of the patterns: "none", "uniform", "ri" or "riu2"')
+    parser.add_argument('--histogram', dest='histogram', action='store_true', default=False, help='whether or not only the histogram of the patterns should be calculated')
+    parser.add_argument('--strip-height', dest='strip_height', type=int, default=256, help='number of rows to process at once (only relevant for "stream-lbp")')
+    parser.add_argument('--tile-size', dest='tile_size', type=str, default='auto', help='size of the tiles as "HEIGHTxWIDTH", a single number for square tiles or "auto" to choose it from the image and cache size (only relevant for "multi-tile-lbp")')
+    parser.add_argument('--schedule', dest='schedule', type=str, default='dynamic', help='order in which processes take tiles: "dynamic" for one tile at a time or "guided" for shrinking chunks of tiles (only relevant for "multi-tile-lbp")')
+    parser.add_argument('--grid', dest='grid', type=str, default=None, help='number of cells as "ROWSxCOLUMNS" to write the concatenated histograms of the cells to grid.txt (requires a mapping)')
+    parser.add_argument('--windows', dest='windows', type=str, default=None, help='size of sliding windows as "HEIGHTxWIDTH" to write the histogram of each window to windows.txt (requires a mapping)')
+    parser.add_argument('--window-stride', dest='window_stride', type=int, default=8, help='distance between sliding windows (only relevant for "--windows")')
+    parser.add_argument('--window-memory', dest='window_memory', type=int, default=256, help='maximum size of the integral histogram in megabytes (only relevant for "--windows")')
     parser.add_argument('--output', dest='output', action='store_true', default=False, help='whether or not an output image should be produced')
+    parser.add_argument('--input-dir', dest='input_dir', type=str, default=None, help='directory of input images to process as a batch')
+    parser.add_argument('--input-glob', dest='input_glob', type=str, default=None, help='glob pattern of input images to process as a batch')
+    parser.add_argument('--input-list', dest='input_list', type=str, default=None, help='file with the file name of an input image on each line to process as a batch')
+    parser.add_argument('--output-dir', dest='output_dir', type=str, default='output', help='directory for storing the outputs of a batch')
+    parser.add_argument('--split-threshold', dest='split_threshold', type=int, default=4000000, help='number of pixels from which an image in a batch is divided over all processes')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False, help='whether or not a batch should be processed in concurrent decode, compute and encode stages')
+    parser.add_argument('--sequence', dest='sequence', action='store_true', default=False, help='whether or not a batch should be processed as a sequence of frames, recalculating only the tiles that changed since the previous frame')
+    parser.add_argument('--decode-workers', dest='decode_workers', type=int, default=1, help='number of processes for decoding images (only relevant for "--pipeline")')
+    parser.add_argument('--encode-workers', dest='encode_workers', type=int, default=1, help='number of processes for encoding outputs (only relevant for "--pipeline")')
+    parser.add_argument('--queue-depth', dest='queue_depth', type=int, default=4, help='maximum number of images waiting between two stages (only relevant for "--pipeline")')
+    parser.add_argument('--train', dest='train', type=str, default=None, help='directory with a subdirectory of images for each label to build a gallery of histograms from')
+    parser.add_argument('--classify', dest='classify', action='store_true', default=False, help='whether or not the input image or batch should be classified with the gallery')
+    parser.add_argument('--gallery', dest='gallery', type=str, default='gallery', help='directory of the gallery (only relevant for "--train" and "--classify")')
+    parser.add_argument('--distance', dest='distance', type=str, default='chi-square', help='distance between histograms: "chi-square", "intersection" or "l1" (only relevant for "--classify")')
+    parser.add_argument('--neighbors', dest='neighbors', type=int, default=1, help='number of nearest histograms that vote on the label (only relevant for "--classify")')
+    parser.add_argument('--index-clusters', dest='index_clusters', type=int, default=0, help='number of clusters of the coarse index of the gallery, or 0 for no index (only relevant for "--train")')
+    parser.add_argument('--probes', dest='probes', type=int, default=8, help='number of clusters of the index to search for each image, or 0 to search the whole gallery (only relevant for "--classify")')
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False, help='whether or not a profile of the run should be written to profile.json (not relevant for batches)')
+    parser.add_argument('--tuning-profile', dest='tuning_profile', type=str, default=os.path.expanduser('~/.lbp-profile.json'), help='file name of the calibration results of this machine (only relevant for "auto")')
+    parser.add_argument('--recalibrate', dest='recalibrate', action='store_true', default=False, help='whether or not the calibration should be repeated (only relevant for "auto")')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', default=True, help='whether or not cached results should be ignored')
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str, default='.lbp-cache', help='directory for storing cached results')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024, help='maximum size of the cache in megabytes')
     arguments = parser.parse_args()
 
-    algorithms = {
-        "lbp": LBP.LBP,
-        "multi-lbp": Multiprocessing_LBP.Multiprocessing_LBP,
-        "multi-lbp-mpi": Multiprocessing_LBP_MPI.Multiprocessing_LBP_MPI,
-        "multi-split-lbp": Multiprocessing_Split_LBP.Multiprocessing_Split_LBP
-    }
-    if arguments.algorithm not in algorithms:
+    # Modules listed in the LBP_PLUGINS environment variable can register additional variants
+    for plugin in os.environ.get('LBP_PLUGINS', '').split(','):
+        if plugin.strip():
+            importlib.import_module(plugin.strip())
+
+    if arguments.algorithm not in algorithms.BACKENDS and arguments.algorithm != "auto":
         print("Invalid algorithm '{}'".format(arguments.algorithm))
         return
 
-    algorithm_class = algorithms[arguments.algorithm]
+    if arguments.kernel not in ["python", "numpy"]:
+        print("Invalid kernel '{}'".format(arguments.kernel))
+        return
 
-    if os.path.isfile(arguments.input):
-        run = algorithm_class(arguments.input, arguments.processes, arguments.output)
-        run.execute()
-    else:
+    if arguments.points < 1 or arguments.points > 32 or arguments.radius <= 0:
+        print("Invalid neighborhood of {} points with radius {}".format(arguments.points, arguments.radius))
+        return
+
+    batch = arguments.input_dir is not None or arguments.input_glob is not None or arguments.input_list is not None
+    classification = arguments.train is not None or arguments.classify
+    if arguments.kernel == "python" and arguments.algorithm not in ["numpy-lbp", "multi-thread-lbp", "sequence-lbp", "auto"] and not batch and not classification and (arguments.points, arguments.radius) != (8, 1):
+        print("The Python kernel only supports 8 points with radius 1, use the NumPy kernel instead")
+        return
+
+    if arguments.mapping not in ["none", "uniform", "ri", "riu2"]:
+        print("Invalid mapping '{}'".format(arguments.mapping))
+        return
+
+    if (arguments.mapping != "none" or arguments.histogram or arguments.train is not None) and arguments.points > 24:
+        print("Mappings and histograms are only supported for at most 24 points")
+        return
+
+    if arguments.strip_height < 1:
+        print("Invalid strip height {}".format(arguments.strip_height))
+        return
+
+    tile_size = None
+    if arguments.tile_size != 'auto':
+        tile_size = parse_size(arguments.tile_size)
+        if tile_size is None:
+            print("Invalid tile size '{}'".format(arguments.tile_size))
+            return
+
+    if arguments.grid is not None or arguments.windows is not None:
+        if arguments.mapping == "none" or arguments.histogram or batch or classification or arguments.algorithm == "stream-lbp":
+            print("Grid and window histograms require a mapping and all patterns of a single image")
+            return
+
+        if any(size is not None and parse_size(size) is None for size in [arguments.grid, arguments.windows]):
+            print("Invalid grid or window size")
+            return
+
+        if arguments.window_stride < 1 or arguments.window_memory < 1:
+            print("Invalid window stride {} or memory {}".format(arguments.window_stride, arguments.window_memory))
+            return
+
+    if arguments.sequence and (not batch or arguments.pipeline):
+        print("A sequence of frames must be given as a batch and can not be processed as a pipeline")
+        return
+
+    if arguments.processes < 1:
+        print("Invalid number of processes {}".format(arguments.processes))
+        return
+
+    if arguments.pipeline and (arguments.decode_workers < 1 or arguments.encode_workers < 1 or arguments.queue_depth < 1):
+        print("Invalid number of decode workers {}, encode workers {} or queue depth {}".format(
+            arguments.decode_workers, arguments.encode_workers, arguments.queue_depth))
+        return
+
+    if arguments.schedule not in ["dynamic", "guided"]:
+        print("Invalid schedule '{}'".format(arguments.schedule))
+        return
+
+    if arguments.cache_size < 0:
+        print("Invalid cache size {}".format(arguments.cache_size))
+        return
+
+    if arguments.distance not in ["chi-square", "intersection", "l1"]:
+        print("Invalid distance '{}'".format(arguments.distance))
+        return
+
+    if arguments.neighbors < 1 or arguments.index_clusters < 0 or arguments.probes < 0:
+        print("Invalid number of neighbors, clusters or probes")
+        return
+
+    if arguments.train is not None and not os.path.isdir(arguments.train):
+        print("Directory '{}' does not exist.".format(arguments.train))
+        return
+
+    if arguments.classify and not os.path.isfile(os.path.join(arguments.gallery, "gallery.json")):
+        print("Gallery '{}' does not exist.".format(arguments.gallery))
+        return
+
+    options = {
+        "points": arguments.points,
+        "radius": arguments.radius,
+        "mapping": arguments.mapping,
+        "histogram_only": arguments.histogram
+    }
+
+    if not batch and arguments.train is None and not os.path.isfile(arguments.input):
         print("File '{}' does not exist.".format(arguments.input))
+        return
+
+    if arguments.algorithm == "auto" and not batch:
+        # Calibrate the variants the first time on this machine with these parameters and
+        # select the fastest configuration for the dimensions of the image from the results
+        from tuning import Tuner
+        tuner = Tuner(arguments.tuning_profile, options)
+        if Tuner.mpi_size() == 1 and (not tuner.load() or arguments.recalibrate):
+            print("Calibrating the variants for this machine and these parameters...")
+            tuner.calibrate()
+            tuner.save()
+
+        selection = tuner.select(*Image.open(arguments.input).size)
+        arguments.algorithm = selection['algorithm']
+        arguments.processes = selection['processes']
+        arguments.shared_memory = selection['shared_memory']
+        arguments.kernel = "numpy"
+        tile_size = selection['tile_size']
+        print("Selected '{}' with {} processes".format(arguments.algorithm, arguments.processes))
+
+    # The results of all variants are identical, so results are shared between them. MPI
+    # is not cached as every process would access the cache, and the streaming variant
+    # only keeps the histogram in memory. A profiled run is never loaded from the cache.
+    cache = None
+    if arguments.cache and (batch or (arguments.algorithm != "multi-lbp-mpi" and not arguments.profile)):
+        if batch or arguments.algorithm != "stream-lbp" or arguments.histogram:
+            cache = Cache(arguments.cache_dir, arguments.cache_size * 1024 * 1024)
+
+    if classification:
+        # Classification always uses the NumPy kernel in histogram only mode. Images are
+        # classified with the parameters that the histograms of the gallery were made with.
+        from classification import Gallery
+        if arguments.train is not None:
+            gallery = Gallery.train(arguments.train, options, arguments.processes, cache)
+            if len(gallery.labels) == 0:
+                print("No images in '{}' could be processed".format(arguments.train))
+                return
+
+            if arguments.index_clusters > 0:
+                gallery.index(arguments.index_clusters)
+
+            gallery.save(arguments.gallery)
+            print("Stored {} histograms of {} labels in '{}'".format(len(gallery.labels), len(set(gallery.labels)), arguments.gallery))
+            return
+
+        gallery = Gallery.load(arguments.gallery)
+        if batch:
+            from batch import Batch
+            inputs = Batch.collect(arguments.input_dir, arguments.input_glob, arguments.input_list)
+        else:
+            inputs = [arguments.input]
+
+        histograms, inputs = Gallery.extract(inputs, gallery.options, arguments.processes, cache)
+        if len(inputs) == 0:
+            print("No images could be classified")
+            return
+
+        labels = gallery.classify(histograms, arguments.neighbors, arguments.distance, arguments.probes or None)
+        for input, label in zip(inputs, labels):
+            print("{}: {}".format(input, label))
+
+        return
+
+    if batch:
+        # Batch mode always uses the NumPy kernel and writes the output of each image.
+        # The batch and pipeline modules are only imported when they are used.
+        from batch import Batch
+        from pipeline import Pipeline
+        inputs = Batch.collect(arguments.input_dir, arguments.input_glob, arguments.input_list)
+        if not os.path.exists(arguments.output_dir):
+            os.makedirs(arguments.output_dir)
+
+        if arguments.sequence:
+            # The frames are processed in order by a single process, which compares each
+            # frame to the previous one and only recalculates the tiles that changed
+            start = time.time()
+            run = None
+            frames = 0
+            skipped = 0.0
+            for input in inputs:
+                output_name = os.path.join(arguments.output_dir, os.path.splitext(os.path.basename(input))[0])
+                try:
+                    if run is None:
+                        run = algorithms.load("sequence-lbp")(input, 1, True, tile_size=tile_size, output_name=output_name, **options)
+                        run.execute()
+                    else:
+                        run.output_name = output_name
+                        run.update(input)
+                except IOError as error:
+                    print("Skipping '{}': {}".format(input, error))
+                    continue
+
+                frames += 1
+                skipped += run.skipped
+                print("{}: skipped {:.1%} of the patterns".format(input, run.skipped))
+
+            elapsed = time.time() - start
+            print("Processed {} frames in {:.2f} seconds ({:.1f} frames per second), skipped {:.1%} of the patterns".format(
+                frames, elapsed, frames / max(elapsed, 1e-9), skipped / max(1, frames)))
+            return
+
+        if arguments.pipeline:
+            # The processes are used for the compute stage of the pipeline
+            workers = {
+                "decode": arguments.decode_workers,
+                "compute": arguments.processes,
+                "encode": arguments.encode_workers
+            }
+            run = Pipeline(inputs, arguments.output_dir, workers, arguments.queue_depth, options, cache)
+        else:
+            run = Batch(inputs, arguments.output_dir, arguments.processes, arguments.split_threshold, options, cache)
+
+        run.execute()
+        if cache is not None:
+            print("Cache: {} hits, {} misses".format(cache.hits, cache.misses))
+
+        return
+
+    try:
+        algorithm_class = algorithms.load(arguments.algorithm)
+    except ImportError as error:
+        print("Algorithm '{}' is not available: {}".format(arguments.algorithm, error))
+        return
+
+    if cache is not None:
+        key = Cache.key(arguments.input, options)
+        result = cache.load(key)
+        if result is not None:
+            if arguments.output:
+                LBP.save(result)
+
+            if arguments.grid is not None or arguments.windows is not None:
+                features(arguments, result)
+
+            print("Cache: {} hits, {} misses".format(cache.hits, cache.misses))
+            return
+
+    run = algorithm_class(arguments.input, arguments.processes, arguments.output, kernel=arguments.kernel,
+                          shared_memory=arguments.shared_memory, strip_height=arguments.strip_height, tile_size=tile_size,
+                          schedule=arguments.schedule, profile=arguments.profile, **options)
+    run.execute()
+    if arguments.profile and (arguments.algorithm != "multi-lbp-mpi" or run.process_id == 0):
+        run.profiler.write(run)
+
+    if (arguments.grid is not None or arguments.windows is not None) and run.patterns is not None:
+        features(arguments, run.patterns)
+
+    if cache is not None:
+        cache.store(key, run.histogram if arguments.histogram else run.patterns)
+        print("Cache: {} hits, {} misses".format(cache.hits, cache.misses))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,158 @@
+import os
+import time
+import numpy as np
+from multiprocessing import Process, Queue
+from algorithms.LBP import LBP
+from algorithms.NumPy_LBP import NumPy_LBP
+from cache import Cache
+
+def decode(item, options, cache):
+    # Decode the image and convert it to grayscale, unless the result is
+    # already cached, in which case the cached result is passed on instead
+    input, output_name = item
+    key = Cache.key(input, options) if cache is not None else None
+    result = cache.load(key) if cache is not None else None
+    if result is not None:
+        return (output_name, key, None, result)
+
+    return (output_name, key, np.array(LBP.decode(input)), None)
+
+def compute(item, options, cache):
+    # Run LBP on the decoded image and cache the result
+    output_name, key, pixels, result = item
+    if result is None:
+        run = NumPy_LBP(pixels, 1, False, **options)
+        run.execute()
+        result = run.histogram if run.histogram_only else run.patterns
+        if cache is not None:
+            cache.store(key, result)
+
+    return (output_name, result)
+
+def encode(item, options, cache):
+    # Encode the result and write it to the output file
+    output_name, result = item
+    LBP.save(result, output_name)
+
+def stage(name, function, options, cache, input_queue, output_queue, statistics):
+    # Process items from the input queue until the end marker is received, while
+    # keeping track of the time spent on processing and on waiting for the queues.
+    # An item that fails is reported and skipped, so one bad image does not stop
+    # the worker, and the statistics are always sent to the main process.
+    busy = 0.0
+    starved = 0.0
+    blocked = 0.0
+    items = 0
+    failed = 0
+    try:
+        while True:
+            start = time.time()
+            item = input_queue.get()
+            starved += time.time() - start
+            if item is None:
+                break
+
+            start = time.time()
+            try:
+                result = function(item, options, cache)
+            except Exception as error:
+                print("Failed to {} '{}': {}".format(name, item[0], error))
+                failed += 1
+                continue
+            finally:
+                busy += time.time() - start
+
+            items += 1
+            if output_queue is not None:
+                start = time.time()
+                output_queue.put(result)
+                blocked += time.time() - start
+    finally:
+        statistics.put({
+            'stage': name,
+            'items': items,
+            'failed': failed,
+            'busy': busy,
+            'starved': starved,
+            'blocked': blocked,
+            'hits': cache.hits if cache is not None else 0,
+            'misses': cache.misses if cache is not None else 0
+        })
+
+class Pipeline:
+    STAGES = [("decode", decode), ("compute", compute), ("encode", encode)]
+
+    def __init__(self, inputs, target, workers, depth, options, cache=None):
+        self.inputs = inputs
+        self.target = target
+        self.workers = workers
+        self.depth = depth
+        self.options = options
+        self.cache = cache
+        self.report = {}
+
+    def execute(self):
+        # Connect the decode, compute and encode stages with bounded queues, so
+        # that the next images are decoded and the previous results are encoded
+        # while the current images are being computed.
+        queues = [Queue()] + [Queue(self.depth) for name, function in Pipeline.STAGES[1:]] + [None]
+        statistics = Queue()
+        for input in self.inputs:
+            name = os.path.splitext(os.path.basename(input))[0]
+            queues[0].put((input, os.path.join(self.target, name)))
+
+        # Spawn the processes of each stage
+        start = time.time()
+        stages = []
+        for index, (name, function) in enumerate(Pipeline.STAGES):
+            processes = []
+            for worker in xrange(self.workers[name]):
+                arguments = (name, function, self.options, self.cache, queues[index], queues[index + 1], statistics)
+                process = Process(target=stage, args=arguments)
+                process.start()
+                processes.append(process)
+
+            stages.append(processes)
+
+        # Stop each stage once all items have passed through the previous stage
+        for index, processes in enumerate(stages):
+            [queues[index].put(None) for process in processes]
+            [process.join() for process in processes]
+
+        # A worker that was killed could not send its statistics, so only wait for
+        # the statistics of the workers that exited normally
+        elapsed = time.time() - start
+        workers = [process for processes in stages for process in processes]
+        for process in workers:
+            if process.exitcode != 0:
+                print("A worker exited with code {}".format(process.exitcode))
+
+        self._report([statistics.get() for process in workers if process.exitcode == 0], elapsed)
+
+    def _report(self, results, elapsed):
+        # Report the occupancy of each stage as the fraction of the available worker
+        # time spent on processing, waiting for input and waiting for output space
+        for name, function in Pipeline.STAGES:
+            available = self.workers[name] * elapsed
+            stage_results = [result for result in results if result['stage'] == name]
+            self.report[name] = {
+                'workers': self.workers[name],
+                'items': sum(result['items'] for result in stage_results),
+                'busy': sum(result['busy'] for result in stage_results) / available,
+                'starved': sum(result['starved'] for result in stage_results) / available,
+                'blocked': sum(result['blocked'] for result in stage_results) / available
+            }
+
+            print("{:>8}: {} workers, {} images, {:.0%} busy, {:.0%} waiting for input, {:.0%} waiting for output".format(
+                name, self.report[name]['workers'], self.report[name]['items'], self.report[name]['busy'],
+                self.report[name]['starved'], self.report[name]['blocked']
+            ))
+
+        print("Processed {} images in {:.2f} seconds, {} failed".format(
+            self.report["encode"]['items'], elapsed, sum(result['failed'] for result in results)))
+
+        # The decode and compute stages look up and store the results in their own processes,
+        # so add the hits and misses that each stage reported to the counters of the cache
+        if self.cache is not None:
+            self.cache.hits += sum(result['hits'] for result in results)
+            self.cache.misses += sum(result['misses'] for result in results)
@@ -1,76 +1,216 @@
 import sys
 import os
+import io
+import json
+import socket
+import hashlib
+import tempfile
+import threading
+import httplib
+import urlparse
+from multiprocessing.pool import ThreadPool
 from BeautifulSoup import BeautifulSoup
-import urllib2
+from PIL import Image
 import imghdr
 import argparse
 
 class Scraper:
     MAIN_URL = 'https://unsplash.com'
-    GRID_URL = 'https://unsplash.com/grid?page={}'
+    GRID_PATH = '/grid?page={}'
 
-    def __init__(self, target, limit):
+    # Images are read in blocks of this number of bytes
+    BLOCK_SIZE = 1024 * 1024
+
+    # Maximum number of redirects to follow for a single request
+    REDIRECTS = 5
+
+    # Number of seconds to wait for a connection or data before giving up on a request
+    TIMEOUT = 60
+
+    def __init__(self, target, limit, workers=8, grayscale=False, url=MAIN_URL):
         self.target = target
         self.limit = limit
-        self.downloaded = 0
+        self.workers = workers
+        self.grayscale = grayscale
+        self.url = url
+        self.manifest_file = os.path.join(target, 'manifest.jsonl')
+
+        # The downloaded images by source URL and by hash of their contents. The lock
+        # protects these and the manifest file, which are shared by all threads.
+        self.sources = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+        # Each thread keeps its own connections open and reuses them for all requests
+        self.local = threading.local()
+
+    def load(self):
+        # Read the manifest of an earlier run, so that images that have already been
+        # downloaded are skipped. The manifest has a JSON object on each line, and the
+        # last line may be incomplete if the earlier run was interrupted while writing.
+        for name in os.listdir(self.target):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.target, name))
+
+        if not os.path.exists(self.manifest_file):
+            return
+
+        with open(self.manifest_file) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                if os.path.exists(os.path.join(self.target, entry['file'])):
+                    self.sources[entry['source']] = entry
+                    self.hashes[entry['hash']] = entry['file']
 
     def scrape(self):
+        # Fetch the grid pages one by one and download the new images on each page with
+        # a pool of threads, until the target directory holds the requested number of
+        # images or the grid has no more pages
+        self.load()
+        pool = ThreadPool(self.workers)
         page_number = 1
-        while self.downloaded < self.limit:
-            dates = []
-            page = urllib2.urlopen(Scraper.GRID_URL.format(page_number))
-            parsed_page = BeautifulSoup(page)
-            for photo in parsed_page.findAll("div", {"class": "photo"}):
-                source = photo.find("a").get("href")
-
-                # Download the photo to the target directory.
-                if self.downloaded >= self.limit:
-                    break
-                
-                self.download(source)
+        while len(self.hashes) < self.limit:
+            sources = self.page(page_number)
+            if not sources:
+                break
 
+            sources = [source for source in sources if source not in self.sources]
+            pool.map(self.download, sources[:self.limit - len(self.hashes)])
             page_number += 1
 
+        pool.close()
+        pool.join()
+
+    def page(self, page_number):
+        # Return the absolute URLs of the photos on a grid page. A page that can not be
+        # fetched, such as the page after the last page, is the end of the grid.
+        try:
+            response = self._request(urlparse.urljoin(self.url, Scraper.GRID_PATH.format(page_number)))
+        except (IOError, httplib.HTTPException) as error:
+            sys.stdout.write("Stopped at grid page {}: {}\n".format(page_number, error))
+            return []
+
+        parsed_page = BeautifulSoup(response.read())
+        return [
+            urlparse.urljoin(self.url, photo.find("a").get("href"))
+            for photo in parsed_page.findAll("div", {"class": "photo"})
+        ]
+
     def download(self, source):
-        downloaded_size = 0
-        block_size = 8192
-        connection = urllib2.urlopen(Scraper.MAIN_URL + source)
-        output_file = '{}/{}'.format(self.target, self.downloaded + 1)
-        output = open('{}.tmp'.format(output_file), 'wb')
-        total_size = int(connection.info().getheaders("Content-Length")[0])
-        
-        while True:
-            buffer = connection.read(block_size)
-            if not buffer:
+        # Download a photo to a temporary file in the target directory while hashing its
+        # contents. Photos are named after their hash, so names never collide between
+        # runs and a photo that was already downloaded from another URL is not kept twice.
+        descriptor, path = tempfile.mkstemp(dir=self.target, suffix='.tmp')
+        digest = hashlib.sha1()
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                response = self._request(source)
+                while True:
+                    buffer = response.read(Scraper.BLOCK_SIZE)
+                    if not buffer:
+                        break
+
+                    digest.update(buffer)
+                    output.write(buffer)
+
+            # Optionally convert the photo to grayscale once, instead of on every LBP run
+            if self.grayscale:
+                with open(path, 'rb') as file:
+                    image = Image.open(io.BytesIO(file.read())).convert("L")
+
+                image.save(path, "PNG")
+        except (IOError, httplib.HTTPException) as error:
+            os.remove(path)
+            sys.stdout.write("Failed to download {}: {}\n".format(source, error))
+            return
+
+        digest = digest.hexdigest()
+        name = '{}.{}'.format(digest[:16], imghdr.what(path) or 'bin')
+        with self.lock:
+            if digest in self.hashes:
+                os.remove(path)
+                name = self.hashes[digest]
+                sys.stdout.write("Skipped {}, which is the same as {}\n".format(source, name))
+            else:
+                os.rename(path, os.path.join(self.target, name))
+                sys.stdout.write("Downloaded image {} of {}: {}\n".format(len(self.hashes) + 1, self.limit, name))
+
+            self._record({'source': source, 'hash': digest, 'file': name})
+
+    def _record(self, entry):
+        # Append an entry to the manifest right away, so an interrupted run can be resumed
+        self.sources[entry['source']] = entry
+        self.hashes[entry['hash']] = entry['file']
+        with open(self.manifest_file, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def _connection(self, scheme, host):
+        # Return the open connection of this thread to the host, or open a new one
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+
+        key = (scheme, host)
+        if key not in self.local.connections:
+            if scheme == 'https':
+                self.local.connections[key] = httplib.HTTPSConnection(host, timeout=Scraper.TIMEOUT)
+            else:
+                self.local.connections[key] = httplib.HTTPConnection(host, timeout=Scraper.TIMEOUT)
+
+        return self.local.connections[key]
+
+    def _request(self, url, redirects=REDIRECTS):
+        # Request the URL over a reused connection and follow any redirects. The response
+        # must be read entirely before the next request on the same connection. If the
+        # server has closed a reused connection in the meantime, it is opened again.
+        parts = urlparse.urlsplit(url)
+        connection = self._connection(parts.scheme, parts.netloc)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        for attempt in xrange(2):
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
                 break
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                if attempt == 1:
+                    raise
+
+        if response.status in [301, 302, 303, 307, 308]:
+            response.read()
+            if redirects == 0:
+                raise IOError("Too many redirects")
 
-            downloaded_size += len(buffer)
-            output.write(buffer)
-            percentage = int(float(downloaded_size * 100) / total_size)
-            message = r"Downloading image {} [{:3d}%]".format(self.downloaded + 1, percentage)
-            message = message + chr(8) * len(message) # Clear the previous message
-            sys.stdout.write(message)
+            return self._request(urlparse.urljoin(url, response.getheader('location')), redirects - 1)
 
-        sys.stdout.write('\n')
-        output.close()
-        self.downloaded += 1
+        if response.status != 200:
+            response.read()
+            raise IOError("HTTP status {}".format(response.status))
 
-        # Rename the temporary file extension to the actual file extension
-        file_type = imghdr.what('{}.tmp'.format(output_file))
-        os.rename('{}.tmp'.format(output_file), '{}.{}'.format(output_file, file_type))
+        return response
 
 def main():
     # Argument parsing
     parser = argparse.ArgumentParser(description='Scrape images from Unsplash.com.')
-    parser.add_argument('--limit', dest='limit', type=int, default=10, help='maximum number of images to scrape')
+    parser.add_argument('--limit', dest='limit', type=int, default=10, help='number of images that the target folder should contain')
     parser.add_argument('--target', dest='target', type=str, default='images', help='name of the folder for storing the downloaded images')
+    parser.add_argument('--workers', dest='workers', type=int, default=8, help='maximum number of images to download at the same time')
+    parser.add_argument('--grayscale', dest='grayscale', action='store_true', default=False, help='whether or not the images should be converted to grayscale PNG images when downloaded')
+    parser.add_argument('--url', dest='url', type=str, default=Scraper.MAIN_URL, help='address of the website to scrape')
     arguments = parser.parse_args()
 
+    if arguments.workers < 1:
+        print("Invalid number of workers {}".format(arguments.workers))
+        return
+
     # Make sure that the target directory exists
     if not os.path.exists(arguments.target):
         os.makedirs(arguments.target)
 
-    scraper = Scraper(arguments.target, arguments.limit)
+    scraper = Scraper(arguments.target, arguments.limit, arguments.workers, arguments.grayscale, arguments.url)
     scraper.scrape()
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import platform
+import multiprocessing
+import numpy as np
+import algorithms
+from algorithms.Multiprocessing_Tiled_LBP import Multiprocessing_Tiled_LBP
+
+class Tuner:
+    # Sizes of the calibration images in megapixels
+    SIZES = [0.25, 1, 4]
+
+    # Tile sizes to calibrate the tiled variant with, where None is the automatic size
+    TILE_SIZES = [None, (128, 128), (512, 512)]
+
+    # Number of runs of each configuration on each image, of which the fastest counts
+    REPETITIONS = 2
+
+    def __init__(self, file_name, options):
+        self.file_name = file_name
+        self.options = options
+        self.profiles = {}
+        self.configurations = []
+
+    @staticmethod
+    def machine():
+        # Describe the machine, so that a profile is only used on the machine it was made on
+        return {
+            'node': platform.node(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'cache_size': Multiprocessing_Tiled_LBP.cache_size()
+        }
+
+    @staticmethod
+    def key(options):
+        # Identify the parameters that a cost model was calibrated with. The number of
+        # points, the radius, the mapping and histogram only mode all change the cost per
+        # pixel and the memory usage, so each combination has its own cost model.
+        return "{}-{}-{}-{}".format(
+            options.get("points", 8), float(options.get("radius", 1)), options.get("mapping", "none"),
+            "histogram" if options.get("histogram_only", False) else "patterns"
+        )
+
+    @staticmethod
+    def mpi_size():
+        # Number of processes started by mpirun, or 1 if this process was not started by it
+        for variable in ['OMPI_COMM_WORLD_SIZE', 'PMI_SIZE']:
+            if variable in os.environ:
+                return int(os.environ[variable])
+
+        return 1
+
+    def candidates(self):
+        # The configurations to calibrate: the single process NumPy variant and the
+        # parallel variants with powers of two up to the number of processors
+        cpu_count = multiprocessing.cpu_count()
+        counts = sorted(set([count for count in [2, 4, 8, 16, 32, 64] if count < cpu_count] + [cpu_count]) - set([1]))
+        candidates = [{'algorithm': 'numpy-lbp', 'processes': 1, 'shared_memory': False, 'tile_size': None}]
+        for count in counts:
+            candidates.append({'algorithm': 'multi-thread-lbp', 'processes': count, 'shared_memory': False, 'tile_size': None})
+            candidates.append({'algorithm': 'multi-split-lbp', 'processes': count, 'shared_memory': True, 'tile_size': None})
+            for tile_size in Tuner.TILE_SIZES:
+                candidates.append({'algorithm': 'multi-tile-lbp', 'processes': count, 'shared_memory': False, 'tile_size': tile_size})
+
+        return candidates
+
+    def load(self):
+        # Load the cost models of this machine, and return whether there is one for the
+        # parameters of this run. The cost models of other parameters are kept, so that
+        # they are saved again together with the cost model of these parameters.
+        try:
+            with open(self.file_name) as file:
+                profile = json.load(file)
+        except (IOError, ValueError):
+            return False
+
+        if profile.get('machine') != Tuner.machine() or not isinstance(profile.get('configurations'), dict):
+            return False
+
+        self.profiles = profile['configurations']
+        if Tuner.key(self.options) not in self.profiles:
+            return False
+
+        self.configurations = self.profiles[Tuner.key(self.options)]
+        for configuration in self.configurations:
+            if configuration['tile_size'] is not None:
+                configuration['tile_size'] = tuple(configuration['tile_size'])
+
+        return True
+
+    def save(self):
+        self.profiles[Tuner.key(self.options)] = self.configurations
+        with open(self.file_name, 'w') as file:
+            json.dump({
+                'machine': Tuner.machine(),
+                'sizes': Tuner.SIZES,
+                'configurations': self.profiles
+            }, file, indent=4, separators=(',', ': '), sort_keys=True)
+
+    def calibrate(self):
+        # Measure each candidate with the parameters of this run on synthetic images of
+        # several sizes and fit a cost model of a fixed overhead plus a cost per pixel to
+        # the measurements. Decoding is the same for all configurations, so the images
+        # are passed as arrays.
+        random = np.random.RandomState(0)
+        images = []
+        for megapixels in Tuner.SIZES:
+            width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+            height = int(round(megapixels * 1e6 / width))
+            images.append(random.randint(0, 256, (height, width)).astype(np.uint8))
+
+        self.configurations = []
+        for candidate in self.candidates():
+            times = [self._measure(candidate, image) for image in images]
+            pixels = [image.size for image in images]
+            slope, intercept = np.polyfit(pixels, times, 1)
+            self.configurations.append(dict(candidate, times=times, model=[float(intercept), float(slope)]))
+
+    def _measure(self, candidate, image):
+        # Return the fastest time of a number of runs of the candidate on the image
+        algorithm = algorithms.load(candidate['algorithm'])
+        times = []
+        for repetition in xrange(Tuner.REPETITIONS):
+            start = time.time()
+            run = algorithm(image, candidate['processes'], False, kernel="numpy", shared_memory=candidate['shared_memory'],
+                            tile_size=candidate['tile_size'], **self.options)
+            run.execute()
+            times.append(time.time() - start)
+
+        return min(times)
+
+    def select(self, width, height):
+        # Select the configuration with the lowest predicted time for an image of the
+        # given dimensions. Processes started by mpirun always use the MPI variant.
+        size = Tuner.mpi_size()
+        if size > 1:
+            return {'algorithm': 'multi-lbp-mpi', 'processes': size, 'shared_memory': False, 'tile_size': None}
+
+        pixels = width * height
+        configuration = min(self.configurations, key=lambda configuration: configuration['model'][0] + configuration['model'][1] * pixels)
+        return dict((key, configuration[key]) for key in ['algorithm', 'processes', 'shared_memory', 'tile_size'])